@@ -0,0 +1,126 @@
+import os
+from Qt import QtCore
+from utils import treeFile
+from utils.journal import Journal
+
+class Autosave(QtCore.QObject):
+	"""
+	Keeps a journal of the model to recover it after a crash (see recover()).
+
+	Changes notified by the model are written together at most once in __interval, in the background.
+	The journal starts with the base the changes are made to, followed by the changes from it
+	(see treeFile.dumpRecordsDelta()). The base is ('commit', hexSha) if the model is loaded from a commit
+	(see setBaseCommit()), otherwise the records of the whole tree (see MTaskModel.getDumpRecords()).
+	Nothing is written until the model is edited, so loading a commit (eg. scrubbing the history) costs nothing
+	and the journal has the model before the load until then.
+	The journal is rewritten from the current tree when the changes get large so that recovering stays fast,
+	and it's removed on close() since there is nothing to recover then
+	"""
+
+	__interval = 2000 # msec
+	__journalByteBudget = 4 * 1024 * 1024 # Rewritten beyond this
+
+	def __init__(self, mTaskModel, filePath, isRecovered=False, parent=None):
+		"""
+		isRecovered: True if the model is recovered from the journal (see recover()), the changes are appended to it
+		"""
+		super(Autosave, self).__init__(parent)
+		self.__mTaskModel = mTaskModel
+		self.__journal = Journal(filePath)
+		self.__journalSize = os.path.getsize(filePath) if isRecovered else 0
+		self.__snapshot = mTaskModel.getSnapshot() # The state of the model written last, or the base
+		self.__base = None # ('commit', hexSha) of the model, None if it's not from a commit
+		self.__isBaseWritten = isRecovered
+
+		self.__timer = QtCore.QTimer(self)
+		self.__timer.setSingleShot(True)
+		self.__timer.setInterval(self.__interval)
+		self.__timer.timeout.connect(self.flush)
+
+		mTaskModel.addObserver(self, events=['modified', 'changeRoot'])
+
+	@staticmethod
+	def recover(mTaskModel, filePath, loadCommit):
+		"""
+		Makes the model as the journal has it, returns False if the journal has nothing.
+		loadCommit(hexSha) returns the dump of the commit the journal starts with (see GitStorage.load())
+		"""
+		entries = Journal.read(filePath)
+		if not entries:
+			return False
+
+		base = entries[0]
+		if isinstance(base, dict):
+			records = base
+		else:
+			kind, hexSha = base
+			dump = loadCommit(hexSha)
+			if isinstance(dump, dict):
+				records = treeFile.copyRecords(dump)
+			else:
+				mTaskModel.setDumpString(dump) # Saved as a single file
+				records = mTaskModel.getDumpRecords()
+
+		for delta in entries[1:]:
+			treeFile.applyRecordsDelta(records, delta)
+		mTaskModel.setDumpRecords(records)
+		return True
+
+	def setBaseCommit(self, hexSha):
+		"""
+		Tells that the model has just been loaded from the commit, so the journal starts with it
+		instead of the records of the whole tree
+		"""
+		if not self.__isBaseWritten:
+			self.__base = ('commit', hexSha)
+
+	def _onNotify(self, notifier, event, data):
+		if event == 'changeRoot':
+			# The changes so far are gone with the old root, the journal is rewritten on the next change
+			self.__timer.stop()
+			self.__snapshot = self.__mTaskModel.getSnapshot()
+			self.__base = None
+			self.__isBaseWritten = False
+			return
+
+		# Not restarted so that continuous changes are written once in the interval
+		if not self.__timer.isActive():
+			self.__timer.start()
+
+	def flush(self):
+		"""
+		Writes the changes made so far without waiting for the interval
+		"""
+		self.__timer.stop()
+		mTaskModel = self.__mTaskModel
+
+		oldRootSnapshot, oldConnectionsSnapshot = self.__snapshot
+		self.__snapshot = mTaskModel.getSnapshot()
+		rootSnapshot, connectionsSnapshot = self.__snapshot
+
+		parents = set(oldConnectionsSnapshot) | set(connectionsSnapshot)
+		edgeChangedParents = [x for x in parents if oldConnectionsSnapshot.get(x) is not connectionsSnapshot.get(x)]
+		getEdges = lambda x: [(y.getFrom(), y.getTo()) for y in mTaskModel.getConnections(x)]
+		delta = treeFile.dumpRecordsDelta(oldRootSnapshot, rootSnapshot, getEdges, edgeChangedParents)
+		if not delta:
+			return
+
+		if not self.__isBaseWritten and self.__base:
+			self.__journalSize = self.__journal.rewrite([self.__base, delta])
+			self.__isBaseWritten = True
+		elif not self.__isBaseWritten or self.__journalSize > self.__journalByteBudget:
+			# Children not loaded yet are loaded for the records, before the snapshot
+			records = mTaskModel.getDumpRecords()
+			self.__snapshot = mTaskModel.getSnapshot()
+			self.__journalSize = self.__journal.rewrite([records])
+			self.__isBaseWritten = True
+		else:
+			self.__journalSize += self.__journal.append(delta)
+
+	def close(self):
+		"""
+		Stops and removes the journal, eg. when the application quits normally
+		"""
+		self.__timer.stop()
+		self.__mTaskModel.removeObserver(self)
+		self.__journal.close(removesFile=True)
@@ -1,28 +1,58 @@
 import os
+import sys
 import inspect
 import datetime
+import threading
 from utils.gitStorage import GitStorage
 from Qt import QtCore, QtGui, QtWidgets, QtCompat
 from helpDialog import HelpDialog
 
 class GitNavigator(QtWidgets.QWidget):
 
-	__hexShaColumn = 0
-	__dateColumn = 1
-	__messageColumn = 2
+	loaded = QtCore.Signal(str) # hexSha of the commit the model is set to
 
-	def __init__(self, mTaskModel):
+	__saved = QtCore.Signal(object) # (message, hexSha, date) or None, emitted from the thread GitStorage saves in
+	__fileName = 'data.tkpickle'
+
+	# Selecting a commit loads it after this while scrubbing stops, in msec
+	__loadDelay = 150
+
+	def __init__(self, mTaskModel, loadsLatest=True):
+		"""
+		loadsLatest: False to keep the model as it is (eg. recovered after a crash) instead of loading the latest commit
+		"""
 		super(GitNavigator, self).__init__()
 
 		repoPath = os.environ['TIME_KEEPER_GIT_REPOSITORY']
 		self.__creatRepoIfNotExists(repoPath)
-		self.__gitStorage = GitStorage(repoPath, 'data.tkpickle')
+		self.__gitStorage = GitStorage(repoPath, self.__fileName)
+		self.__logModel = _GitLogModel(self.__gitStorage, self)
 
 		self.__mTaskModel = mTaskModel
+		# Own GitStorage since git.Repo can't be used by two threads at once
+		self.__loader = _SnapshotLoader(GitStorage(repoPath, self.__fileName), mTaskModel, self)
+		self.__loadingHexSha = None # The commit the model has or is going to have
+
+		self.__loadTimer = QtCore.QTimer(self)
+		self.__loadTimer.setSingleShot(True)
+		self.__loadTimer.setInterval(self.__loadDelay)
+
 		self.__loadUiFile()
 		self.__connectSignalSlot()
 		self.updateUi()
-		self.__load()
+		if loadsLatest:
+			self.__load()
+		else:
+			self.__loadTimer.stop()
+			self.__loadingHexSha = self.__logModel.getHexSha(0)
+
+	@staticmethod
+	def loadCommit(hexSha):
+		"""
+		Returns the dump of the commit (see GitStorage.load()) read on its own, eg. for Autosave.recover()
+		"""
+		repoPath = os.environ['TIME_KEEPER_GIT_REPOSITORY']
+		return GitStorage(repoPath, GitNavigator.__fileName).load(hexSha)
 
 	def __creatRepoIfNotExists(self, repoPath):
 		if not GitStorage.isRepoReady(repoPath):
@@ -35,63 +65,91 @@ class GitNavigator(QtWidgets.QWidget):
 		uiFilePath = os.path.join(dirname, 'loadDialog.ui')
 		self.__ui = QtCompat.loadUi(uiFilePath, self)
 
+		logTV = self.__ui.logTV
+		logTV.setModel(self.__logModel)
+		logTV.hideColumn(_GitLogModel.hexShaColumn)
+
 	def __connectSignalSlot(self):
 		ui = self.__ui
 		ui.scrabHS.valueChanged.connect(self.__onScrabValueChanged)
-		ui.logTW.itemClicked.connect(self.__onLogItemClicked)
-		ui.logTW.itemSelectionChanged.connect(self.__onLogItemSelectionChanged)
+		ui.logTV.clicked.connect(self.__onLogItemClicked)
+		ui.logTV.selectionModel().selectionChanged.connect(self.__onLogItemSelectionChanged)
 		ui.savePB.clicked.connect(self.__onSave)
+		self.__logModel.rowsInserted.connect(self.__onLogRowsInserted)
+		self.__loadTimer.timeout.connect(self.__load)
+		self.__loader.loaded.connect(self.__onLoaded)
+		self.__saved.connect(self.__onSaved)
 
 	def updateUi(self):
-		logs = self.__log()
-		logs.reverse()
-
-		maxLogCount = len(logs) - 1
+		"""
+		Adds the commits made since the last update and selects the newest
+		"""
+		self.__logModel.fetchNewer()
+		self.__ui.logTV.selectRow(0)
 
-		scrabHS = self.__ui.scrabHS
-		scrabHS.setMaximum(maxLogCount)
-		scrabHS.setValue(maxLogCount)
+	# The log is the newest first while the slider goes from the oldest(left) loaded so far to the newest
+	def __getCurrentRow(self):
+		return self.__ui.logTV.currentIndex().row()
 
-		logTW = self.__ui.logTW
-		logTW.hideColumn(self.__hexShaColumn)
-		logTW.setRowCount(len(logs))
-
-		for rowCount, log in enumerate(logs):
-			message, hexSha, date = log
-			dateStr = datetime.datetime.fromtimestamp(date).strftime('%Y/%m/%d %H:%M:%S')
-
-			logTW.setItem(rowCount, self.__hexShaColumn, QtWidgets.QTableWidgetItem(hexSha))
-			logTW.setItem(rowCount, self.__dateColumn, QtWidgets.QTableWidgetItem(dateStr))
-			logTW.setItem(rowCount, self.__messageColumn, QtWidgets.QTableWidgetItem(message.replace('\n', ' ')))
-
-		logTW.selectRow(maxLogCount)
+	def __rowToScrabValue(self, row):
+		return self.__logModel.rowCount() - 1 - row
 
 	def __save(self, commitMessage):
-		dumpString = self.__mTaskModel.getDumpString()
-		self.__gitStorage.save(dumpString, commitMessage)
+		# Each node is saved as a file so that commits share unchanged ones
+		dumpRecords = self.__mTaskModel.getDumpRecords()
+		self.__gitStorage.save(dumpRecords, commitMessage, onSaved=self.__saved.emit)
 
 	def __load(self):
-		row = self.__ui.logTW.currentRow()
-		item = self.__ui.logTW.item(row, self.__hexShaColumn)
-		if item:
-			hexSha = item.text()
-			dumpString = self.__gitStorage.load(hexSha)
-			self.__mTaskModel.setDumpString(dumpString)
+		"""
+		Starts loading the selected commit, the model is set when it's decoded (see __onLoaded())
+		"""
+		self.__loadTimer.stop()
+		hexSha = self.__logModel.getHexSha(self.__getCurrentRow())
+		if hexSha and hexSha != self.__loadingHexSha:
+			self.__loadingHexSha = hexSha
+			self.__loader.request(hexSha)
+
+	def __onLoaded(self, hexSha, decodedRecords, dumpString, excInfo):
+		if hexSha != self.__loadingHexSha:
+			return # Another commit was selected while loading
+		if excInfo:
+			self.__loadingHexSha = None
+			raise excInfo[0], excInfo[1], excInfo[2]
 
-	def __log(self, maxCount=-1): # [(message, hexSha, date)]
-		return self.__gitStorage.log(maxCount)
+		# The nodes are created here in the GUI thread
+		if decodedRecords is not None:
+			self.__mTaskModel.setDecodedDumpRecords(decodedRecords)
+		else:
+			self.__mTaskModel.setDumpString(dumpString) # Saved as a single file
+		self.loaded.emit(hexSha)
 
 	def __onScrabValueChanged(self, value):
-		self.__ui.logTW.selectRow(value)
+		# Older commits are appended, so the row stays on the same commit after fetching them
+		row = self.__rowToScrabValue(value)
+		logModel = self.__logModel
+		if value == 0 and logModel.canFetchMore(QtCore.QModelIndex()):
+			logModel.fetchMore(QtCore.QModelIndex())
+		self.__ui.logTV.selectRow(row)
 
-	def __onLogItemClicked(self, items):
-		row = self.__ui.logTW.currentRow()
-		self.__ui.scrabHS.setValue(row)
+	def __onLogItemClicked(self, index):
+		self.__ui.scrabHS.setValue(self.__rowToScrabValue(self.__getCurrentRow()))
 
 	def __onLogItemSelectionChanged(self):
-		row = self.__ui.logTW.currentRow()
-		self.__ui.scrabHS.setValue(row)
-		self.__load()
+		self.__ui.scrabHS.setValue(self.__rowToScrabValue(self.__getCurrentRow()))
+		# Restarted on each change, so only the commit scrubbing stops at is loaded
+		self.__loadTimer.start()
+
+	def __onLogRowsInserted(self, parent, first, last):
+		# Keep the slider on the same commit
+		scrabHS = self.__ui.scrabHS
+		wasBlocked = scrabHS.blockSignals(True)
+		try:
+			scrabHS.setMaximum(self.__logModel.rowCount() - 1)
+			row = self.__getCurrentRow()
+			if row >= 0:
+				scrabHS.setValue(self.__rowToScrabValue(row))
+		finally:
+			scrabHS.blockSignals(wasBlocked)
 
 	def __onSave(self):
 
@@ -102,8 +160,20 @@ class GitNavigator(QtWidgets.QWidget):
 			'')
 
 		if isOk:
+			self.__ui.savePB.setEnabled(False)
 			self.__save(commitMessage)
-			self.updateUi()
+
+	def __onSaved(self, log):
+		self.__ui.savePB.setEnabled(True)
+		if not log:
+			self.__gitStorage.waitSaved() # Raises the error
+			return
+
+		# Added as it's saved instead of reading the log, which would wait for the saving thread.
+		# The model has it already, so selecting it doesn't load it
+		self.__loadingHexSha = log[1]
+		self.__logModel.addNewest(log)
+		self.__ui.logTV.selectRow(0)
 
 	def _onNotify(self, notifier, event, data):
 		if event == 'toggleGitNavigator':
@@ -123,3 +193,140 @@ class GitNavigator(QtWidgets.QWidget):
 	def __toggleVisibility(self):
 		isVisible = self.isVisible()
 		self.setVisible(not isVisible)
+
+# ------------------------------------------------------
+class _SnapshotLoader(QtCore.QObject):
+	"""
+	Reads and decodes commits in a background thread, into plain values that the model is made from
+	in the GUI thread (see MTaskModel.decodeDumpRecords()).
+	While it's busy only the latest request is kept, the ones before it are skipped
+	"""
+
+	# hexSha, decoded records or None, dump string if saved as a single file, sys.exc_info() if it failed
+	loaded = QtCore.Signal(object, object, object, object)
+
+	def __init__(self, gitStorage, mTaskModel, parent=None):
+		super(_SnapshotLoader, self).__init__(parent)
+		self.__gitStorage = gitStorage
+		self.__mTaskModel = mTaskModel
+		self.__lock = threading.Lock()
+		self.__requestedHexSha = None
+		self.__isRunning = False
+
+	def request(self, hexSha):
+		with self.__lock:
+			self.__requestedHexSha = hexSha
+			if self.__isRunning:
+				return
+			self.__isRunning = True
+
+		thread = threading.Thread(target=self.__run)
+		thread.daemon = True
+		thread.start()
+
+	def __run(self):
+		while True:
+			with self.__lock:
+				hexSha = self.__requestedHexSha
+				self.__requestedHexSha = None
+				if hexSha is None:
+					self.__isRunning = False
+					return
+
+			decodedRecords = dumpString = excInfo = None
+			try:
+				dump = self.__gitStorage.load(hexSha)
+				if isinstance(dump, dict):
+					decodedRecords = self.__mTaskModel.decodeDumpRecords(dump)
+				else:
+					dumpString = dump
+			except:
+				excInfo = sys.exc_info()
+			self.loaded.emit(hexSha, decodedRecords, dumpString, excInfo)
+
+# ------------------------------------------------------
+class _GitLogModel(QtCore.QAbstractTableModel):
+	"""
+	Commits of GitStorage, the newest first.
+	Only the recent ones are read at first, older ones are read a page at a time as the view scrolls down
+	"""
+
+	hexShaColumn = 0
+	dateColumn = 1
+	messageColumn = 2
+
+	__headers = ('hexSha', 'Date', 'Message')
+	__pageSize = 200
+
+	def __init__(self, gitStorage, parent=None):
+		super(_GitLogModel, self).__init__(parent)
+		self.__gitStorage = gitStorage
+		self.__rows = [] # [(hexSha, dateStr, message)] in column order
+		self.__hasOlder = True
+
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.__rows)
+
+	def columnCount(self, parent=QtCore.QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.__headers)
+
+	def data(self, index, role=QtCore.Qt.DisplayRole):
+		if role != QtCore.Qt.DisplayRole or not index.isValid():
+			return None
+		return self.__rows[index.row()][index.column()]
+
+	def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+		if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+			return self.__headers[section]
+		return None
+
+	def canFetchMore(self, parent):
+		return not parent.isValid() and self.__hasOlder
+
+	def fetchMore(self, parent):
+		"""
+		Appends the next page of older commits
+		"""
+		if not self.canFetchMore(parent):
+			return
+		before = self.__rows[-1][self.hexShaColumn] if self.__rows else None
+		logs = self.__gitStorage.log(self.__pageSize, before=before)
+		self.__hasOlder = len(logs) == self.__pageSize
+		self.__insertRows(len(self.__rows), logs)
+
+	def fetchNewer(self):
+		"""
+		Prepends the commits made since the newest one read, or reads the first page
+		"""
+		if not self.__rows:
+			self.fetchMore(QtCore.QModelIndex())
+			return
+		logs = self.__gitStorage.log(after=self.__rows[0][self.hexShaColumn])
+		self.__insertRows(0, logs)
+
+	def addNewest(self, log):
+		"""
+		Prepends (message, hexSha, date) of a commit just made
+		"""
+		self.__insertRows(0, [log])
+
+	def getHexSha(self, row):
+		if 0 <= row < len(self.__rows):
+			return self.__rows[row][self.hexShaColumn]
+		return None
+
+	def __insertRows(self, row, logs):
+		if not logs:
+			return
+		rows = []
+		for message, hexSha, date in logs:
+			dateStr = datetime.datetime.fromtimestamp(date).strftime('%Y/%m/%d %H:%M:%S')
+			rows.append((hexSha, dateStr, message.replace('\n', ' ')))
+
+		self.beginInsertRows(QtCore.QModelIndex(), row, row + len(rows) - 1)
+		self.__rows[row:row] = rows
+		self.endInsertRows()
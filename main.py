@@ -1,17 +1,27 @@
+import os
 import sys
 from Qt import QtWidgets
 from taskModel import MTaskModel
 from taskView import GTaskCanvas
 from gitNavigator import GitNavigator
+from autosave import Autosave
 app = QtWidgets.QApplication(sys.argv)
 
 model = MTaskModel()
 
+# The journal is left only if the application didn't quit normally
+autosavePath = os.environ.get('TIME_KEEPER_AUTOSAVE', os.path.expanduser('~/.timeKeeper.tkjournal'))
+isRecovered = Autosave.recover(model, autosavePath, GitNavigator.loadCommit)
+
 canvas = GTaskCanvas(model)
 canvas.show()
 
-gitNavigator = GitNavigator(model)
+gitNavigator = GitNavigator(model, loadsLatest=not isRecovered)
 gitNavigator.show()
 
-model.addObserver(gitNavigator)
+autosave = Autosave(model, autosavePath, isRecovered)
+gitNavigator.loaded.connect(autosave.setBaseCommit)
+app.aboutToQuit.connect(autosave.close)
+
+model.addObserver(gitNavigator, events=['toggleGitNavigator'])
 app.exec_()
@@ -7,7 +7,7 @@
 
 import copy
 from Qt import QtGui, QtCore, QtWidgets
-from utils.mergeableDict import DynamicMergeableDict
+from utils.mergeableDict import FrozenMergedDict
 from paintStyle import PaintStyle, PaintConfigMixin
 
 
@@ -28,7 +28,7 @@ def _getLineTanNormal(line):
 class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 
 	_paintStyle = PaintStyle()
-	_config = DynamicMergeableDict(
+	_config = FrozenMergedDict(
 		arrowHeadSize = 5,
 		selectionLineWidth = 4,
 		)
@@ -40,7 +40,7 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 
 		self.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable)
 		# TODO: Fix the problem where a node is occluded by another node and the connection from/to the node is not
-		self.setZValue(canvas.getMaxZValue() + 1)
+		self.setZValue(canvas.allocateZValue())
 		self.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
 		self.__isDeleted = False
 
@@ -51,7 +51,7 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		self.close()
 		self.__isDeleted = True
 
-	def __getArrowHeadPolygon(self, arrowTail, arrowTip):
+	def _getArrowHeadPolygon(self, arrowTail, arrowTip):
 		line = QtCore.QLineF(arrowTail, arrowTip)
 		tangentVector, normalVector = _getLineTanNormal(line)
 
@@ -68,8 +68,9 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		return arrowHead
 
 	# Qt callbacks
+	# arrowHead is the polygon from _getArrowHeadPolygon() if a subclass has it already
 
-	def _shape(self, arrowTail, arrowTip):
+	def _shape(self, arrowTail, arrowTip, arrowHead=None):
 		path = QtGui.QPainterPath()
 		if (not arrowTip) or (not arrowTail):
 			return path
@@ -78,7 +79,8 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		tangentVectorUnused, normalVector = _getLineTanNormal(line)
 		linewidth = self._config['selectionLineWidth']
 
-		arrowHead = self.__getArrowHeadPolygon(arrowTail, arrowTip)
+		if arrowHead is None:
+			arrowHead = self._getArrowHeadPolygon(arrowTail, arrowTip)
 		path.addPolygon(arrowHead)
 
 		# Make the line thicker for easy selection
@@ -93,7 +95,7 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 
 		return path
 
-	def _boundingRect(self, arrowTail, arrowTip):
+	def _boundingRect(self, arrowTail, arrowTip, shape=None):
 		if (not arrowTip) or (not arrowTail):
 			return QtCore.QRectF()
 
@@ -102,32 +104,36 @@ class _GArrowShapeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		if self.__isDeleted:
 			return QtCore.QRectF()
 
-		rect = QtCore.QRectF(arrowTail, arrowTip)
+		# The shape has the line and the arrow head, the pen is drawn over their outlines
+		if shape is None:
+			shape = self._shape(arrowTail, arrowTip)
+		paintStyle = self._getPaintStyle()
+		margin = max(paintStyle.getBorderPenWidth(False), paintStyle.getBorderPenWidth(True)) / 2.0
+		return shape.boundingRect().adjusted(-margin, -margin, margin, margin)
 
-		arrowHead = self.__getArrowHeadPolygon(arrowTail, arrowTip)
-		rect = rect.united(arrowHead.boundingRect())
-
-		return rect
-
-	def _paint(self, painter, option, widget, arrowTail, arrowTip, isSelected):
+	def _paint(self, painter, option, widget, arrowTail, arrowTip, isSelected, arrowHead=None):
 		if (not arrowTip) or (not arrowTail):
 			return
 
-		self._paintStyle.applyBorderPen(painter, isSelected)
-		self._paintStyle.applyBgBrush(painter, isSelected)
+		paintStyle = self._getPaintStyle()
+		paintStyle.applyBorderPen(painter, isSelected)
+		paintStyle.applyBgBrush(painter, isSelected)
 		painter.drawLine(arrowTail, arrowTip)
 
-		self._paintStyle.applyBorderBrush(painter, isSelected)
-		arrowHead = self.__getArrowHeadPolygon(arrowTail, arrowTip)
+		paintStyle.applyBorderBrush(painter, isSelected)
+		if arrowHead is None:
+			arrowHead = self._getArrowHeadPolygon(arrowTail, arrowTip)
 		painter.drawPolygon(arrowHead);
 
 # ------------------------------------------------------
 class _GConnectionCreationShape(_GArrowShapeBase):
 
 	def setArrowTail(self, arrowTail):
+		self.prepareGeometryChange()
 		self.__arrowTail = arrowTail
 
 	def setArrowTip(self, arrowTip):
+		self.prepareGeometryChange()
 		self.__arrowTip = arrowTip
 
 	# Qt callbacks
@@ -146,8 +152,20 @@ class _GConnectionCreationShape(_GArrowShapeBase):
 
 class GCanvas(QtWidgets.QGraphicsScene):
 
+	# Z values are renormalized when the max z value exceeds max(this, twice the number of distinct z values)
+	__minZValueRenormalizeThreshold = 100000
+
+	# Nodes are drawn in detail when zoomed in to this scale, or to the other one past the node count (see isDetailed())
+	__detailMinScale = 0.5
+	__detailMaxNodeCount = 200
+	__detailMinScaleOfManyNodes = 1.5
+
 	def __init__(self, *args, **kargs):
 		super(GCanvas, self).__init__(*args, **kargs)
+		self.__maxZValue = 0
+		self.__zValueRenormalizeThreshold = self.__minZValueRenormalizeThreshold
+		self.__nodeCount = 0
+		self.__isDetailed = True
 		self.__view = _GView(None)
 		self.__view.setScene(self)
 		self.__gNodeFrom = None
@@ -159,12 +177,91 @@ class GCanvas(QtWidgets.QGraphicsScene):
 	def show(self):
 		self.__view.show()
 
+	def getNodeCount(self):
+		"""
+		Returns the number of the nodes on this canvas
+		"""
+		return self.__nodeCount
+
+	def _onNodeAdded(self):
+		self.__nodeCount += 1
+		self.__onNodeCountChanged()
+
+	def _onNodeDeleted(self):
+		self.__nodeCount -= 1
+		self.__onNodeCountChanged()
+
+	def __onNodeCountChanged(self):
+		for view in self.views():
+			if isinstance(view, _GView):
+				view._onNodeCountChanged()
+
+	def isDetailed(self):
+		"""
+		Returns False if nodes should be drawn in a simple way (eg. without widgets)
+		since they are small on the view or too many to draw in detail
+		"""
+		return self.__isDetailed
+
+	def _updateDetail(self, scale):
+		"""
+		Called by the view with its scale when it's zoomed or the number of the nodes is changed
+		"""
+		if self.__nodeCount <= self.__detailMaxNodeCount:
+			isDetailed = scale >= self.__detailMinScale
+		else:
+			isDetailed = scale >= self.__detailMinScaleOfManyNodes
+
+		if isDetailed != self.__isDetailed:
+			self.__isDetailed = isDetailed
+			self._onDetailChanged()
+
+	def _onDetailChanged(self):
+		"""
+		Called when isDetailed() is changed. Reimplement this to change how the nodes are drawn
+		"""
+		self.update()
+
+	def _getViewAnchoredRect(self, view):
+		"""
+		Returns QRect in the viewport coordinates of the view of what drawBackground() draws relative to
+		the view (eg. a title) instead of the canvas, which is repainted as the view scrolls.
+		Reimplement this if drawBackground() draws such a thing
+		"""
+		return QtCore.QRect()
+
 	def getMaxZValue(self):
-		maxValue = 0
-		for item in self.items():
-			if item.zValue() > maxValue:
-				maxValue = item.zValue()
-		return maxValue
+		"""
+		Returns the largest z value allocated by allocateZValue()
+		"""
+		return self.__maxZValue
+
+	def allocateZValue(self):
+		"""
+		Returns a z value that brings an item in front of all the other items on this canvas
+		"""
+		if self.__maxZValue >= self.__zValueRenormalizeThreshold:
+			self.__renormalizeZValues()
+		self.__maxZValue += 1
+		return self.__maxZValue
+
+	def __renormalizeZValues(self):
+		# Reassign compact z values to the top level items keeping their stacking order
+		# so that allocated z values don't grow forever
+		topLevelItems = [x for x in self.items() if not x.parentItem()]
+		topLevelItems.sort(key=lambda x: x.zValue())
+
+		zValue = 0
+		lastOldZValue = None
+		for item in topLevelItems:
+			oldZValue = item.zValue()
+			if oldZValue != lastOldZValue: # Items at the same z value stay at the same z value
+				lastOldZValue = oldZValue
+				zValue += 1
+			item.setZValue(zValue)
+
+		self.__maxZValue = zValue
+		self.__zValueRenormalizeThreshold = max(self.__minZValueRenormalizeThreshold, zValue * 2)
 
 	def mousePressEvent(self, event):
 
@@ -209,8 +306,6 @@ class GCanvas(QtWidgets.QGraphicsScene):
 			if itemTo and itemTo != gnodeFrom:
 				self._createConnection(gnodeFrom, itemTo)
 
-			self.update()
-
 		elif self.__rubberBand.isVisible():
 			view = self.views()[0]
 			rect = view.mapToScene(self.__rubberBand.geometry())
@@ -220,8 +315,6 @@ class GCanvas(QtWidgets.QGraphicsScene):
 
 			self.setSelectionArea(painterPath)
 
-			self.update()
-
 		self.__rubberBand.hide()
 		self.__rubberBandStartPos = None
 
@@ -249,35 +342,112 @@ class GCanvas(QtWidgets.QGraphicsScene):
 
 	def __showArrow(self, event):
 		self.__connectionCreationShape.setArrowTip(event.scenePos())
-		self.update()
 
 # ------------------------------------------------------
 class _GView(QtWidgets.QGraphicsView):
+	"""
+	Only the parts of the viewport the changed items cover are repainted, so items must paint within
+	their bounding rects and call prepareGeometryChange() before they change.
+	Render hints are lowered when zoomed out or when the canvas has many nodes, see __updateRenderHints().
+	They and the detail of the canvas are updated when the zoom or the number of the nodes changes,
+	not while painting, since changing them repaints the view
+	"""
+
+	# Zoomed out beyond these or with more nodes than these, the render hints are turned off
+	__highQualityMinScale = 0.75
+	__highQualityMaxNodeCount = 300
+	__antialiasingMinScale = 0.3
+	__antialiasingMaxNodeCount = 3000
+
+	# Ctrl + mouse wheel zooms by this for each step of the wheel, within the range
+	__zoomStep = 1.15
+	__minScale = 0.05
+	__maxScale = 4.0
 
 	def __init__(self, parent):
 		super(_GView, self).__init__(parent)
-		self.setRenderHint(QtGui.QPainter.Antialiasing, True)
-		self.setRenderHint(QtGui.QPainter.TextAntialiasing, True)
-		self.setRenderHint(QtGui.QPainter.HighQualityAntialiasing, True)
-		self.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
 		self.setRenderHint(QtGui.QPainter.NonCosmeticDefaultPen, True)
-		self.setViewportUpdateMode(QtWidgets.QGraphicsView.FullViewportUpdate)
+		self.__updateRenderHints()
+		self.setViewportUpdateMode(QtWidgets.QGraphicsView.SmartViewportUpdate)
 		self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
 
+	def __updateRenderHints(self):
+		scale = self.transform().m11()
+		canvas = self.scene()
+		nodeCount = canvas.getNodeCount() if isinstance(canvas, GCanvas) else 0
+
+		isHighQuality = scale >= self.__highQualityMinScale and nodeCount <= self.__highQualityMaxNodeCount
+		isAntialiased = scale >= self.__antialiasingMinScale and nodeCount <= self.__antialiasingMaxNodeCount
+
+		# setRenderHint() repaints the whole viewport, only when a hint is changed
+		hints = [
+			(QtGui.QPainter.Antialiasing, isAntialiased),
+			(QtGui.QPainter.TextAntialiasing, isAntialiased),
+			(QtGui.QPainter.HighQualityAntialiasing, isHighQuality),
+			(QtGui.QPainter.SmoothPixmapTransform, isHighQuality),
+			]
+		renderHints = self.renderHints()
+		for hint, isOn in hints:
+			if bool(renderHints & hint) != isOn:
+				self.setRenderHint(hint, isOn)
+
+	def __onDisplayChanged(self):
+		# Zoomed or the number of the nodes is changed
+		self.__updateRenderHints()
+		canvas = self.scene()
+		if isinstance(canvas, GCanvas):
+			canvas._updateDetail(self.transform().m11())
+
+	def _onNodeCountChanged(self):
+		self.__onDisplayChanged()
+
+	def scale(self, sx, sy):
+		super(_GView, self).scale(sx, sy)
+		self.__onDisplayChanged()
+
+	# Qt callbacks
+
+	def wheelEvent(self, event):
+		if event.modifiers() != QtCore.Qt.ControlModifier:
+			super(_GView, self).wheelEvent(event)
+			return
+
+		scale = self.transform().m11()
+		newScale = scale * self.__zoomStep ** (event.angleDelta().y() / 120.0)
+		newScale = min(max(newScale, self.__minScale), self.__maxScale)
+		self.scale(newScale / scale, newScale / scale)
+		event.accept()
+
+	def scrollContentsBy(self, dx, dy):
+		super(_GView, self).scrollContentsBy(dx, dy)
+		# The background drawn relative to the view (eg. a title) is scrolled with the items, so it's repainted
+		# where it is and where the scrolled copy is
+		canvas = self.scene()
+		if isinstance(canvas, GCanvas):
+			rect = canvas._getViewAnchoredRect(self)
+			if not rect.isEmpty():
+				self.viewport().update(rect)
+				self.viewport().update(rect.translated(dx, dy))
+
 # ------------------------------------------------------
 class GNodeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 
 	def __init__(self, canvas):
 		super(GNodeBase, self).__init__()
 		canvas.addItem(self)
+		canvas._onNodeAdded()
+		self.__isDeleted = False
 
 		self.__connections = []
 
 		self.setFlag(QtWidgets.QGraphicsItem.ItemIsMovable)
 		self.setFlag(QtWidgets.QGraphicsItem.ItemIsSelectable)
-		self.setZValue(canvas.getMaxZValue() + 1)
+		self.setZValue(canvas.allocateZValue())
 		self.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
 
+		# Moved or resized in any way, eg. dragged or set from the model
+		self.geometryChanged.connect(self.__onGeometryChanged)
+
 	def delete(self):
 		"""
 		Delete this node, and all the connections from/to this node
@@ -285,6 +455,9 @@ class GNodeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		while self.__connections:
 			connection = self.__connections.pop()
 			connection.delete()
+		if not self.__isDeleted:
+			self.__isDeleted = True
+			self.scene()._onNodeDeleted()
 		self.close()
 
 	def _getCenter(self):
@@ -326,14 +499,13 @@ class GNodeBase(QtWidgets.QGraphicsWidget, PaintConfigMixin):
 		"""
 		raise NotImplementedError
 
-	def mouseMoveEvent(self, event):
-		super(GNodeBase, self).mouseMoveEvent(event)
+	def __onGeometryChanged(self):
 		for connection in self.__connections:
-			connection.update()
+			connection._onNodeGeometryChanged()
 
 	def itemChange(self, change, value):
 		if change == QtWidgets.QGraphicsItem.GraphicsItemChange.ItemSelectedHasChanged:
-			newMaxZValue = self.scene().getMaxZValue() + 1
+			newMaxZValue = self.scene().allocateZValue()
 			self.setZValue(newMaxZValue)
 			for connection in self.__connections:
 				connection.setZValue(newMaxZValue)
@@ -353,6 +525,7 @@ class GConnection(_GArrowShapeBase):
 		nodeTo._addConnection(self)
 		self.__nodeFrom = nodeFrom
 		self.__nodeTo = nodeTo
+		self.__geometry = None # (arrowTail, arrowTip, arrowHead, shape, boundingRect), None until it's computed
 
 	def delete(self):
 		"""
@@ -360,15 +533,49 @@ class GConnection(_GArrowShapeBase):
 		"""
 		self.__nodeFrom._removeConnection(self)
 		self.__nodeTo._removeConnection(self)
+		self.__invalidateGeometry() # Where it's drawn is repainted, it has no bounding rect after this
 		super(GConnection, self).delete()
 		self.__nodeFrom = None
 		self.__nodeTo = None
 
+	def getNodes(self):
+		"""
+		Returns (nodeFrom, nodeTo), or (None, None) if deleted
+		"""
+		return self.__nodeFrom, self.__nodeTo
+
+	def _onNodeGeometryChanged(self):
+		"""
+		Called when either node is moved or resized
+		"""
+		self.__invalidateGeometry()
+
+	def _onStyleUpdated(self):
+		self.__invalidateGeometry()
+
+	def __invalidateGeometry(self):
+		# Qt has not asked for the bounding rect since it was invalidated last time if it's None
+		if self.__geometry is not None:
+			self.prepareGeometryChange()
+			self.__geometry = None
+
+	def __getGeometry(self):
+		# Computed once until the nodes or the style change, not for each of shape(), boundingRect() and paint()
+		if self.__geometry is None:
+			arrowTail, arrowTip = self.__getArrowTailTip()
+			arrowHead = self._getArrowHeadPolygon(arrowTail, arrowTip) if arrowTail and arrowTip else None
+			shape = self._shape(arrowTail, arrowTip, arrowHead)
+			boundingRect = self._boundingRect(arrowTail, arrowTip, shape)
+			self.__geometry = (arrowTail, arrowTip, arrowHead, shape, boundingRect)
+		return self.__geometry
+
 	# Qt callbacks
 
 	def shape(self):
-		arrowTail, arrowTip = self.__getArrowTailTip()
-		return self._shape(arrowTail, arrowTip)
+		if not self.__nodeFrom:
+			return QtGui.QPainterPath()
+
+		return self.__getGeometry()[3]
 
 	def boundingRect(self):
 		# boundingRect() is called after self.close() inside delete() and before the node is actually deleted
@@ -377,13 +584,12 @@ class GConnection(_GArrowShapeBase):
 		if not self.__nodeFrom:
 			return QtCore.QRectF()
 
-		arrowTail, arrowTip = self.__getArrowTailTip()
-		return self._boundingRect(arrowTail, arrowTip)
+		return self.__getGeometry()[4]
 
 	def paint(self, painter, option, widget):
-		arrowTail, arrowTip = self.__getArrowTailTip()
+		arrowTail, arrowTip, arrowHead, shape, boundingRect = self.__getGeometry()
 		isSelected = self.isSelected()
-		self._paint(painter, option, widget, arrowTail, arrowTip, isSelected)
+		self._paint(painter, option, widget, arrowTail, arrowTip, isSelected, arrowHead)
 
 	def __getArrowTailTip(self):
 		line = QtCore.QLineF(self.__nodeFrom._getCenter(), self.__nodeTo._getCenter())
@@ -397,7 +603,7 @@ class GConnection(_GArrowShapeBase):
 class GRectNode(GNodeBase):
 
 	_paintStyle = PaintStyle()
-	_config = DynamicMergeableDict(
+	_config = FrozenMergedDict(
 		shapeRoundRadius=3,
 		dragBorderWidth=4,
 		dragCursorEnabled=(True, True), # horizontal, vertical
@@ -492,10 +698,11 @@ class GRectNode(GNodeBase):
 
 	def paint(self, painter, option, widget):
 		isSelected = self.isSelected()
-		self._paintStyle.applyBorderPen(painter, isSelected)
-		self._paintStyle.applyBgBrush(painter, isSelected)
+		paintStyle = self._getPaintStyle()
+		paintStyle.applyBorderPen(painter, isSelected)
+		paintStyle.applyBgBrush(painter, isSelected)
 		r = self._config['shapeRoundRadius']
-		painter.drawRoundedRect(self.boundingRect(), r, r)
+		painter.drawRoundedRect(paintStyle.getBorderRect(self.boundingRect(), isSelected), r, r)
 
 	def mousePressEvent(self, event):
 		super(GRectNode, self).mousePressEvent(event)
@@ -540,7 +747,7 @@ class GRectNode(GNodeBase):
 class GDotNode(GNodeBase):
 
 	_paintStyle = PaintStyle()
-	_config = DynamicMergeableDict(
+	_config = FrozenMergedDict(
 		dotRadius=7,
 		)
 
@@ -569,9 +776,10 @@ class GDotNode(GNodeBase):
 
 	def paint(self, painter, option, widget):
 		isSelected = self.isSelected()
-		self._paintStyle.applyBorderPen(painter, isSelected)
-		self._paintStyle.applyBgBrush(painter, isSelected)
-		painter.drawEllipse(self.boundingRect())
+		paintStyle = self._getPaintStyle()
+		paintStyle.applyBorderPen(painter, isSelected)
+		paintStyle.applyBgBrush(painter, isSelected)
+		painter.drawEllipse(paintStyle.getBorderRect(self.boundingRect(), isSelected))
 
 # ======================================================
 if __name__ == '__main__':
@@ -3,7 +3,7 @@
 
 import copy
 from Qt import QtGui, QtCore
-from utils.mergeableDict import DynamicMergeableDict
+from utils.mergeableDict import FrozenMergedDict
 
 # ======================================================
 # Default style values used by PaintStyle class
@@ -24,13 +24,13 @@ _defaultStyle = {
 class PaintStyle(object):
 
 	def __init__(self, style=_defaultStyle, doUpdate=True):
-		self.__styleInfo = DynamicMergeableDict()
-		self.__styleInfo.update(style)
+		self.__style = style # Values over the base style
+		self.__styleInfo = FrozenMergedDict(style) # Resolved with the base style
 		if doUpdate:
 			self.__update()
 
 	def setBaseStyle(self, baseConfig):
-		self.__styleInfo.setBase(baseConfig.__styleInfo)
+		self.__styleInfo = FrozenMergedDict(baseConfig.__styleInfo, self.__style)
 		self.__update()
 
 	def setBorderPen(self, borderPenCol, borderPenColSel, borderPenSize, borderPenSizeSel):
@@ -45,6 +45,19 @@ class PaintStyle(object):
 		self.__borderBrush = self.__createBrush(paintCol)
 		self.__borderBrushSel = self.__createBrush(paintColSel)
 
+	def getBorderPenWidth(self, isSelected):
+		if isSelected:
+			return self.__borderPenSel.widthF()
+		else:
+			return self.__borderPen.widthF()
+
+	def getBorderRect(self, rect, isSelected):
+		"""
+		Returns rect shrunk so that the border pen drawn along it stays within rect
+		"""
+		margin = self.getBorderPenWidth(isSelected) / 2.0
+		return rect.adjusted(margin, margin, -margin, -margin)
+
 	def applyBorderPen(self, painter, isSelected):
 		if isSelected:
 			painter.setPen(self.__borderPenSel)
@@ -64,10 +77,11 @@ class PaintStyle(object):
 			painter.setBrush(self.__borderBrush)
 
 	def __update(self):
-		s = self.__styleInfo
-		self.setBorderPen(s['borderPen']['col'], s['borderPen']['colSel'], s['borderPen']['size'], s['borderPen']['sizeSel'])
-		self.setBgBrush(s['bgPaint']['col'], s['bgPaint']['colSel'])
-		self.setBorderBrush(s['borderPen']['col'], s['borderPen']['colSel'])
+		borderPen = self.__styleInfo['borderPen']
+		bgPaint = self.__styleInfo['bgPaint']
+		self.setBorderPen(borderPen['col'], borderPen['colSel'], borderPen['size'], borderPen['sizeSel'])
+		self.setBgBrush(bgPaint['col'], bgPaint['colSel'])
+		self.setBorderBrush(borderPen['col'], borderPen['colSel'])
 
 	@staticmethod
 	def __createPen(lineStyle, width, color):
@@ -87,7 +101,40 @@ class PaintStyle(object):
 class PaintConfigMixin(object):
 	"""
 	Subclass must have _paintStyle and _config members.
+	_config is a FrozenMergedDict resolved when it's updated, so reading it while painting is a plain dict lookup
+
+	Subclass can have _variantStyles {variant: style} to paint instances differently (eg. by status),
+	the PaintStyle of a variant is built once and shared by all the instances (see _getVariantPaintStyle())
 	"""
+
+	_variantStyles = {}
+	__variantPaintStyles = {} # {(cls, variant): PaintStyle}, cleared when any style is updated
+
+	def _onStyleUpdated(self):
+		"""
+		Called by updateStyle() for each item on the canvas, override this to drop what's computed from the style
+		"""
+		pass
+
+	def _getPaintStyle(self):
+		"""
+		Returns the PaintStyle to paint self with. Override this to return the one of the variant of self
+		"""
+		return self._paintStyle
+
+	@classmethod
+	def _getVariantPaintStyle(cls, variant):
+		"""
+		Returns the PaintStyle of _variantStyles[variant] over _paintStyle
+		"""
+		key = (cls, variant)
+		paintStyle = PaintConfigMixin.__variantPaintStyles.get(key)
+		if paintStyle is None:
+			paintStyle = PaintStyle(cls._variantStyles[variant], False)
+			paintStyle.setBaseStyle(cls._paintStyle)
+			PaintConfigMixin.__variantPaintStyles[key] = paintStyle
+		return paintStyle
+
 	@classmethod
 	def updateStyle(cls, canvas, config=None, paintConfig=None):
 		"""
@@ -95,12 +142,15 @@ class PaintConfigMixin(object):
 		"""
 		if paintConfig:
 			current = cls._paintStyle
-			cls._paintStyle = PaintStyle(paintConfig)
+			cls._paintStyle = PaintStyle(paintConfig, False)
 			cls._paintStyle.setBaseStyle(current)
 		if config:
-			current = cls._config
-			cls._config = DynamicMergeableDict()
-			cls._config.update(config)
-			cls._config.setBase(current)
+			cls._config = FrozenMergedDict(cls._config, config)
+
+		# Subclasses may have variants over the style updated
+		PaintConfigMixin.__variantPaintStyles.clear()
+		for item in canvas.items():
+			if isinstance(item, PaintConfigMixin):
+				item._onStyleUpdated()
 
 		canvas.update()
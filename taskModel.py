@@ -1,20 +1,36 @@
+import mmap
+import heapq
 import cPickle as pickle
 from utils.observable import Observable
-from utils.treeNode import TreeNode
+from utils.treeNode import TreeNode, NOT_EXIST
+from utils.undoStack import UndoStack
+from utils import treeFile
 
 # ======================================================
 class MTaskModel(Observable):
 
+	# Memory budget of the undo history in number of node snapshots.
+	# Snapshots share unchanged subtrees so a step usually costs only the changed nodes and their ancestors
+	__undoCostBudget = 200000
+
 	def __init__(self):
 		super(MTaskModel, self).__init__()
 		self.__theRoot = MTaskNode()
-		self.__connections = []
+		self.__theRoot.addObserver(self)
+		self.__connections = _ConnectionIndex()
 
 		self.__invalidNode = MTaskNode()
 		self.__invalidNode.setName('NOT EXISTS')
 
 		self.__pasteData = None # pickle of ([mNode], [mConnection])
 
+		self.__undoStack = UndoStack(self.__undoCostBudget)
+		self.__undoGroupDepth = 0
+		self.__isUndoGroupChanged = False
+		self.__lastUndoNotifySerial = None
+		self.__isRestoring = False
+		self.__resetUndo()
+
 	def getRoot(self):
 		return self.__theRoot
 
@@ -23,37 +39,56 @@ class MTaskModel(Observable):
 
 	def getConnections(self, limitUnderThisChildren=None):
 		if limitUnderThisChildren:
-			connections = []
-			for connection in self.__connections:
-				if connection.getFrom().getParent() == limitUnderThisChildren:
-					connections.append(connection)
-			return connections
+			if not limitUnderThisChildren.isChildrenLoaded():
+				limitUnderThisChildren.getChildren() # Connections between them are loaded with them
+			return self.__connections.getByParent(limitUnderThisChildren)
 		else:
-			return self.__connections
+			return self.__connections.getAll()
+
+	def getNodeConnections(self, mNode):
+		"""
+		Returns connections from/to mNode
+		"""
+		return self.__connections.getByNode(mNode)
+
+	def hasConnection(self, mNodeFrom, mNodeTo):
+		"""
+		Returns True if the nodes are connected in either direction
+		"""
+		return self.__connections.has(mNodeFrom, mNodeTo) or self.__connections.has(mNodeTo, mNodeFrom)
 
 	def clear(self):
-		for node in self.__theRoot.getChildren():
-			node.delete()
+		self.__beginBatch()
+		try:
+			for node in self.__theRoot.getChildren():
+				node.delete()
+		finally:
+			self.__endBatch()
 		assert(not self.__connections)
 
 	def save(self, filePath):
+		# Before opening the file, which may be the memory mapped file that nodes are loaded from
+		dumpString = self.getDumpString()
 		with open(filePath, 'wb') as f:
-			pickle.dump((self.__theRoot, self.__connections), f)
+			f.write(dumpString)
 
 	def load(self, filePath):
-		with open(filePath) as f:
-			theRoot, connections = pickle.load(f)
-		self.__theRoot = theRoot
-		self.__connections = connections
-		self.__observe([theRoot], connections)
-		self._notify('changeRoot')
+		with open(filePath, 'rb') as f:
+			try:
+				data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError: # Empty file
+				data = ''
+		self.setDumpString(data)
 
 	def copy(self, mNodes):
 		connections = []
 
-		for connection in self.getConnections():
-			if connection.getFrom() in mNodes and connection.getTo() in mNodes:
-				connections.append(connection)
+		mNodeSet = set(mNodes)
+		for mNode in mNodes:
+			for connection in self.getNodeConnections(mNode):
+				# Visit each connection once, from its start node
+				if connection.getFrom() == mNode and connection.getTo() in mNodeSet:
+					connections.append(connection)
 
 		self.__pasteData = pickle.dumps((mNodes, connections))
 
@@ -65,61 +100,136 @@ class MTaskModel(Observable):
 
 		nodes, connections = pickle.loads(self.__pasteData)
 
-		for node in nodes:
-			node.setParent(parent)
-			if isinstance(node, MTaskNode):
-				self._notify('createTask', node)
-			elif isinstance(node, MTaskDotNode):
-				self._notify('createDot', node)
+		self.__beginBatch()
+		try:
+			for node in nodes:
+				if isinstance(node, MTaskNode):
+					node.updateRollUps() # Stale if copied before a batch of roll-ups is flushed
+				node.setParent(parent)
+				self.__notifyNodeCreation(node)
 
-		for connection in connections:
-			self.__connections.append(connection)
-			self._notify('createConnection', connection)
+			for connection in connections:
+				self.__addConnection(connection)
 
-		for node in nodes:
-			if isinstance(node, MTaskNode):
-				self.assignUniqueName(node, node.getName())
+			for node in nodes:
+				if isinstance(node, MTaskNode):
+					self.assignUniqueName(node, node.getName())
 
-		self.__observe(nodes, connections)
+			self.__observe(nodes, connections)
+		finally:
+			self.__endBatch()
 
 		return nodes, connections
 
 	def getDumpString(self):
-		return pickle.dumps((self.__theRoot, self.__connections))
+		return treeFile.dumps(self.__theRoot, self.__getAllEdges())
+
+	def getDumpRecords(self):
+		"""
+		Same as getDumpString() but returns records (see treeFile.dumpRecords()),
+		to be saved so that unchanged nodes are shared with the other versions
+		"""
+		return treeFile.dumpRecords(self.__theRoot, self.__getAllEdges())
+
+	def __getAllEdges(self):
+		# Lazily loaded subtrees are loaded to be saved with their connections
+		nodes = [self.__theRoot]
+		while nodes:
+			nodes.extend(nodes.pop().getChildren())
+
+		return [(x.getFrom(), x.getTo()) for x in self.__connections.getAll()]
 
 	def setDumpString(self, dumString):
-		theRoot, connections = pickle.loads(dumString)
+		"""
+		Nodes are loaded lazily as they are accessed, so dumString can be a memory mapped file.
+		Accepts files saved by older versions too
+		"""
+		nodeClasses = dict((x.__name__, x) for x in [MTaskNode, MTaskDotNode])
+		if treeFile.isTreeFile(dumString):
+			theRoot = treeFile.LazyTree(dumString, nodeClasses, self.__onEdgesLoaded).createRoot()
+			connections = []
+		else:
+			theRoot, connections = pickle.loads(dumString[:])
+		self.__setContent(theRoot, connections)
+
+	def setDumpRecords(self, records):
+		"""
+		Same as setDumpString() but for the result of getDumpRecords()
+		"""
+		self.setDecodedDumpRecords(self.decodeDumpRecords(records))
+
+	@staticmethod
+	def decodeDumpRecords(records):
+		"""
+		First half of setDumpRecords(), returns what setDecodedDumpRecords() takes.
+		No node is created, so it can be called from another thread
+		"""
+		return treeFile.decodeRecords(records)
 
-		self.__theRoot = theRoot
-		self.__connections = connections
-		self.__observe([theRoot], connections)
-		self._notify('changeRoot')
+	def setDecodedDumpRecords(self, decodedRecords):
+		"""
+		Second half of setDumpRecords(), makes the result of decodeDumpRecords() the content of the model
+		"""
+		nodeClasses = dict((x.__name__, x) for x in [MTaskNode, MTaskDotNode])
+		theRoot, edges = treeFile.createDecodedNodes(decodedRecords, nodeClasses)
+		self.__setContent(theRoot, [MTaskConnection(x, y) for x, y in edges])
+
+	def __setContent(self, theRoot, connections):
+		Observable.beginNotifyBatch()
+		try:
+			if not theRoot.hasAttr('doneCount'):
+				theRoot.updateRollUps() # Saved before the roll-ups other than 'actual'
+
+			self.__theRoot = theRoot
+			self.__connections = _ConnectionIndex(connections)
+			self.__observe([theRoot], connections)
+			self.__resetUndo()
+			self._notify('changeRoot')
+		finally:
+			Observable.endNotifyBatch()
 
 	def __observe(self, nodes, connections):
 
 		def observeNode(node):
-			if not isinstance(node, MTaskNode):
+			if not isinstance(node, (MTaskNode, MTaskDotNode)):
 				return
-			if not self in node.getObservers():
+			if not node.hasObserver(self):
 				node.addObserver(self)
-			for child in node.getChildren():
-				observeNode(child)
+			# Children not loaded yet are observed when they are loaded
+			if node.isChildrenLoaded():
+				for child in node.getChildren():
+					observeNode(child)
 
 		for node in nodes:
 			observeNode(node)
 
 		for connection in connections:
-			if not self in connection.getObservers():
+			if not connection.hasObserver(self):
 				connection.addObserver(self)
 
+	def __onEdgesLoaded(self, parent, edges):
+		connections = [MTaskConnection(x, y) for x, y in edges]
+		self.__connections.addLoaded(parent, connections)
+		self.__observe([], connections)
+
 	def createTaskNode(self, parent):
-		node = self.__createNode(parent, MTaskNode, 'createTask')
-		self.assignUniqueName(node)
-		node.addObserver(self)
+		self.beginUndoGroup()
+		try:
+			node = self.__createNode(parent, MTaskNode, 'createTask')
+			self.assignUniqueName(node)
+			node.addObserver(self)
+		finally:
+			self.endUndoGroup()
 		return node
 
 	def createTaskDotNode(self, parent):
-		return self.__createNode(parent, MTaskDotNode, 'createDot')
+		self.beginUndoGroup()
+		try:
+			node = self.__createNode(parent, MTaskDotNode, 'createDot')
+			node.addObserver(self) # To delete connections from/to the node on its deletion
+		finally:
+			self.endUndoGroup()
+		return node
 
 	def createTaskConnection(self, mNodeFrom, mNodeTo):
 		"""
@@ -129,17 +239,28 @@ class MTaskModel(Observable):
 		self.__checkNode(mNodeFrom)
 		assert(mNodeFrom.getParent() == mNodeTo.getParent())
 
-		for connection in self.__connections:
-			if connection.getFrom() == mNodeFrom and connection.getTo() == mNodeTo:
-				return None
-			if connection.getFrom() == mNodeTo and connection.getTo() == mNodeFrom:
-				return None
+		if self.hasConnection(mNodeFrom, mNodeTo):
+			return None
 
 		connection = MTaskConnection(mNodeFrom, mNodeTo)
-		self.__connections.append(connection)
+		self.beginUndoGroup()
+		try:
+			self.__addConnection(connection)
+		finally:
+			self.endUndoGroup()
+		return connection
+
+	def __addConnection(self, connection):
+		self.__connections.add(connection)
 		connection.addObserver(self)
+		self.__recordUndo()
 		self._notify('createConnection', connection) # For canvas update
-		return connection
+
+	def __notifyNodeCreation(self, node):
+		if isinstance(node, MTaskNode):
+			self._notify('createTask', node) # For canvas update
+		elif isinstance(node, MTaskDotNode):
+			self._notify('createDot', node)
 
 	def __createNode(self, parent, taskClass, eventToEmit):
 		node = taskClass(parent)
@@ -168,15 +289,161 @@ class MTaskModel(Observable):
 	def _onNotify(self, notifier, event, data):
 		if event == 'attrChanged':
 			attrName, oldValue, newValue = data
+			# Views write back the same values they are given, these are not changes
+			if oldValue != newValue:
+				self.__recordUndo(self.__getAttrMergeKey())
 			if attrName == 'name':
 				assert(isinstance(notifier, MTaskNode))
 				self._notify('renameTaskNode', notifier) # For canvas update
+		elif event in ['childAdded', 'childRemoved']:
+			self.__recordUndo()
+		elif event == 'childrenLoaded':
+			self.__observe(notifier.getChildren(), [])
 		if event == 'deleted':
-			if notifier in self.__connections:
+			if isinstance(notifier, MTaskConnection):
 				self.__connections.remove(notifier)
 			else:
-				assert(isinstance(notifier, MTaskNode))
-				self._notify('deleteTaskNode', notifier) # For canvas update
+				assert(isinstance(notifier, (MTaskNode, MTaskDotNode)))
+				for connection in self.getNodeConnections(notifier):
+					connection.delete()
+				if isinstance(notifier, MTaskNode):
+					self._notify('deleteTaskNode', notifier) # For canvas update
+			self.__recordUndo()
+
+	# Undo/redo
+
+	def undo(self):
+		state = self.__undoStack.undo()
+		if state:
+			self.__restore(state)
+
+	def redo(self):
+		state = self.__undoStack.redo()
+		if state:
+			self.__restore(state)
+
+	def canUndo(self):
+		return self.__undoStack.canUndo()
+
+	def canRedo(self):
+		return self.__undoStack.canRedo()
+
+	def beginUndoGroup(self):
+		"""
+		Changes made until the matching endUndoGroup() call are undone at once. Can be nested
+		"""
+		self.__undoGroupDepth += 1
+		MTaskNode.beginRollUpBatch()
+
+	def endUndoGroup(self):
+		assert(self.__undoGroupDepth > 0)
+		# Roll-ups are updated while the group is still open so that they are in the same step
+		MTaskNode.endRollUpBatch()
+		self.__undoGroupDepth -= 1
+		if not self.__undoGroupDepth and self.__isUndoGroupChanged:
+			self.__isUndoGroupChanged = False
+			state, cost = self.__takeSnapshot()
+			self.__undoStack.push(state, cost)
+			self.__lastUndoNotifySerial = None
+
+	def _beginItemChange(self):
+		"""
+		Called by nodes and connections being deleted or moved (see _callAsUndoStep()),
+		so that the change and what it causes are undone at once wherever it's called from
+		"""
+		self.__beginBatch()
+
+	def _endItemChange(self):
+		self.__endBatch()
+
+	def __beginBatch(self):
+		# An undo step that updates views once at the end
+		Observable.beginNotifyBatch()
+		self.beginUndoGroup()
+
+	def __endBatch(self):
+		try:
+			self.endUndoGroup()
+		finally:
+			Observable.endNotifyBatch()
+
+	def __recordUndo(self, mergeKey=None):
+		self._notify('modified') # Any change including undo/redo, eg. for autosave
+
+		if self.__isRestoring:
+			return
+
+		if self.__undoGroupDepth:
+			self.__isUndoGroupChanged = True
+			return
+
+		state, cost = self.__takeSnapshot()
+
+		# Events notified while notifying another event (eg. 'actual' of the ancestors) belong to the same step
+		notifySerial = Observable.getNotifySerial()
+		if notifySerial is not None and notifySerial == self.__lastUndoNotifySerial:
+			self.__undoStack.replaceCurrent(state, cost)
+		else:
+			self.__undoStack.push(state, cost, mergeKey)
+		self.__lastUndoNotifySerial = notifySerial
+
+	@staticmethod
+	def __getAttrMergeKey():
+		# Consecutive changes of an attribute of a node (eg. typing, dragging) are undone at once.
+		# The key is of the attribute changed by the caller, not of the roll-ups it causes which are notified
+		# before it reaches the model, so that a change of another node is never merged
+		origin = Observable.getNotifyOrigin()
+		if origin is None or origin[1] != 'attrChanged':
+			return None
+		notifier, event, data = origin
+		return notifier, data[0]
+
+	def __resetUndo(self):
+		state, cost = self.__takeSnapshot()
+		self.__undoStack.reset(state, cost)
+		self.__lastUndoNotifySerial = None
+
+	def __takeSnapshot(self):
+		# Returns (state, cost). Cost is the number of node snapshots newly built for the state
+		buildCount = TreeNode.getSnapshotBuildCount()
+		state = self.getSnapshot()
+		return state, TreeNode.getSnapshotBuildCount() - buildCount
+
+	def getSnapshot(self):
+		"""
+		Returns (TreeNodeSnapshot of the root, {mParent: (mConnection, ...)}) of the current state.
+		Unchanged parts are shared with the snapshots taken before, so comparing them with 'is' finds changes
+		"""
+		return self.__theRoot.getSnapshot(), self.__connections.getSnapshot()
+
+	def __restore(self, state):
+		rootSnapshot, connectionsSnapshot = state
+
+		self.__isRestoring = True
+		Observable.beginNotifyBatch()
+		try:
+			revivedNodes = self.__theRoot.restoreSnapshot(rootSnapshot)
+			self.__observe(revivedNodes, [])
+			for node in revivedNodes:
+				self.__notifyNodeCreation(node)
+
+			# Connections from/to nodes deleted above have been deleted already
+			currentConnectionsSnapshot = self.__connections.getSnapshot()
+			parents = set(currentConnectionsSnapshot.keys()) | set(connectionsSnapshot.keys())
+			for parent in parents:
+				currentConnections = currentConnectionsSnapshot.get(parent, ())
+				connections = self.__connections.getFromSnapshot(connectionsSnapshot, parent)
+				if currentConnections is connections:
+					continue # Unchanged
+				for connection in set(currentConnections) - set(connections):
+					connection.delete()
+				for connection in set(connections) - set(currentConnections):
+					self.__addConnection(connection)
+		finally:
+			self.__isRestoring = False
+			Observable.endNotifyBatch()
+
+		self.__lastUndoNotifySerial = None
 
 	@staticmethod
 	def assignUniqueName(node, prefix=None):
@@ -184,42 +451,212 @@ class MTaskModel(Observable):
 		if not parent:
 			return '' # Root node name is ''
 
-		existingNames = [x.getName() for x in parent.getChildren() if isinstance(x, MTaskNode)]
-
-		if prefix and prefix not in existingNames:
+		if prefix and not parent.getChild(prefix):
 			node.setName(prefix)
 			return
 
-		counter = 0
 		if prefix:
-			while prefix[-1].isdigit():
-				prefix = prefix[:-1]
+			prefix = MTaskNode.splitNameNumber(prefix)[0]
 		if not prefix:
 			prefix = 'task'
 
-		while prefix + str(counter) in existingNames:
-			counter += 1
-
-		newName = prefix + str(counter)
-		node.setName(newName)
+		node.setName(parent.getFreeChildName(prefix))
 
 	def sendToggleNavigator(self):
 		self._notify('toggleGitNavigator')
 
+# ------------------------------------------------------
+def _callAsUndoStep(item, function, *args):
+	"""
+	Calls function (eg. delete() of the node or connection) so that the models observing the item record
+	it as one undo step. Deleting a node notifies 'childRemoved' and 'deleted' separately and deletes
+	its connections in between, and moving it notifies 'childRemoved' and 'childAdded' and updates roll-ups
+	"""
+	models = [x for x in item.getObservers() if isinstance(x, MTaskModel)]
+	for model in models:
+		model._beginItemChange()
+	try:
+		return function(*args)
+	finally:
+		for model in models:
+			model._endItemChange()
+
+# ------------------------------------------------------
+class _ConnectionIndex(object):
+	"""
+	Set of MTaskConnections indexed by (from, to) pair, by endpoint node and by
+	the parent node that owns them. A connection belongs to the parent of its
+	end nodes at the time it is added.
+	"""
+
+	def __init__(self, connections=()):
+		self.__pairToConnection = {} # {(mNodeFrom, mNodeTo): mConnection}
+		self.__nodeToConnections = {} # {mNode: {mConnection: None}}
+		self.__parentToConnections = {} # {mParent: {mConnection: None}}
+		self.__connectionToParent = {} # {mConnection: mParent}
+
+		self.__snapshot = None # Cached getSnapshot() result
+		self.__parentToSnapshot = {} # {mParent: (mConnection, ...)} cached per parent
+		self.__parentToLoaded = {} # {mParent: (mConnection, ...)} connections as lazily loaded
+
+		for connection in connections:
+			self.add(connection)
+
+	def __len__(self):
+		return len(self.__connectionToParent)
+
+	def __contains__(self, connection):
+		return connection in self.__connectionToParent
+
+	def add(self, connection):
+		if connection in self.__connectionToParent:
+			return
+
+		mNodeFrom = connection.getFrom()
+		mNodeTo = connection.getTo()
+		parent = mNodeFrom.getParent()
+
+		self.__pairToConnection[(mNodeFrom, mNodeTo)] = connection
+		self.__nodeToConnections.setdefault(mNodeFrom, {})[connection] = None
+		self.__nodeToConnections.setdefault(mNodeTo, {})[connection] = None
+		self.__parentToConnections.setdefault(parent, {})[connection] = None
+		self.__connectionToParent[connection] = parent
+		self.__invalidateSnapshot(parent)
+
+	def remove(self, connection):
+		if connection not in self.__connectionToParent:
+			return
+
+		mNodeFrom = connection.getFrom()
+		mNodeTo = connection.getTo()
+		parent = self.__connectionToParent.pop(connection)
+
+		if self.__pairToConnection.get((mNodeFrom, mNodeTo)) == connection:
+			del self.__pairToConnection[(mNodeFrom, mNodeTo)]
+		self.__discard(self.__nodeToConnections, mNodeFrom, connection)
+		self.__discard(self.__nodeToConnections, mNodeTo, connection)
+		self.__discard(self.__parentToConnections, parent, connection)
+		self.__invalidateSnapshot(parent)
+
+	def addLoaded(self, parent, connections):
+		"""
+		Add connections between the children of the parent which are lazily loaded.
+		Snapshots taken before that are regarded to have had them, see getFromSnapshot()
+		"""
+		self.__parentToLoaded[parent] = tuple(connections)
+		for connection in connections:
+			self.add(connection)
+
+	def has(self, mNodeFrom, mNodeTo):
+		return (mNodeFrom, mNodeTo) in self.__pairToConnection
+
+	def get(self, mNodeFrom, mNodeTo):
+		return self.__pairToConnection.get((mNodeFrom, mNodeTo))
+
+	def getAll(self):
+		return self.__connectionToParent.keys()
+
+	def getByNode(self, mNode):
+		return self.__nodeToConnections.get(mNode, {}).keys()
+
+	def getByParent(self, parent):
+		return self.__parentToConnections.get(parent, {}).keys()
+
+	def getSnapshot(self):
+		"""
+		Returns {mParent: (mConnection, ...)} which must not be modified.
+		Tuples of parents whose connections haven't changed are shared between snapshots
+		"""
+		if self.__snapshot is None:
+			snapshot = {}
+			for parent, connections in self.__parentToConnections.items():
+				parentSnapshot = self.__parentToSnapshot.get(parent)
+				if parentSnapshot is None:
+					parentSnapshot = tuple(connections.keys())
+					self.__parentToSnapshot[parent] = parentSnapshot
+				snapshot[parent] = parentSnapshot
+			# A parent missing in a snapshot has no connections, or hadn't loaded them when the snapshot was taken
+			for parent in self.__parentToLoaded:
+				snapshot.setdefault(parent, ())
+			self.__snapshot = snapshot
+		return self.__snapshot
+
+	def getFromSnapshot(self, snapshot, parent):
+		"""
+		Returns connections of the parent in the snapshot
+		"""
+		return snapshot.get(parent, self.__parentToLoaded.get(parent, ()))
+
+	def __invalidateSnapshot(self, parent):
+		self.__parentToSnapshot.pop(parent, None)
+		self.__snapshot = None
+
+	@staticmethod
+	def __discard(indexDict, key, connection):
+		connections = indexDict.get(key)
+		if connections is None:
+			return
+		connections.pop(connection, None)
+		if not connections:
+			del indexDict[key]
+
 # ------------------------------------------------------
 class MTaskNode(TreeNode):
+
+	# Attributes summed up from the children; [(attrName, sourceAttrName, leafValue)]
+	# A node without children has leafValue(its source attribute) instead, or keeps its value if leafValue is None
+	__rollUps = [
+		('actual', 'actual', None), # Actual time, given for leaf tasks
+		('estimatedTotal', 'estimated', lambda x: x), # Estimated time of the leaf tasks
+		('doneCount', 'status', lambda x: 1 if x == 'done' else 0), # Number of the leaf tasks done
+		('wipCount', 'status', lambda x: 1 if x == 'wip' else 0), # Number of the leaf tasks in progress
+	]
+	__rollUpNames = set([x[0] for x in __rollUps])
+
+	# Events a node observes of itself, and of its children
+	__ownEvents = frozenset([('attrChanged', x[1]) for x in __rollUps] + [('attrChanged', 'name'), 'childAdded', 'childRemoved'])
+	__childEvents = frozenset([('attrChanged', x[0]) for x in __rollUps] + [('attrChanged', 'name')])
+
+	# Cached paths are valid while this is the same, it's incremented when any node is renamed or moved
+	__pathGeneration = 0
+
+	__rollUpBatchDepth = 0
+	__pendingRollUpDeltas = {} # {mNode: {attrName: delta}} added when the batch ends
+	__pendingRollUpHeap = [] # [(-depth, id, mNode)] of __pendingRollUpDeltas, the deepest first
+	__isRestoringSnapshot = False
+
 	def __init__(self, parent=None, name=''):
+		self.__childIndex = None # {name: [child]} of MTaskNode children, None until getChild() is called
+		self.__nameCounters = None # {prefix: [counter, freeNumbers]}, see getFreeChildName()
+		self.__pathCache = None # (__pathGeneration, path)
 		super(MTaskNode, self).__init__(parent)
 		self.setAttr('name', name) # Node name
 		self.setAttr('description', '') # Long description
 		self.setAttr('estimated', 0) # Estimated time
 		self.setAttr('actual', 0) # Actual time needed
 		self.setAttr('status', 'waiting') # 'waiting', 'wip', 'done'
+		self.setAttr('estimatedTotal', 0) # Roll-ups, see __rollUps
+		self.setAttr('doneCount', 0)
+		self.setAttr('wipCount', 0)
 
 		self.setAttr('pos', (0, 0))
 		self.setAttr('size', (0, 0))
 
-		self.addObserver(self)
+		self.addObserver(self, events=self.__ownEvents)
+
+	@classmethod
+	def _createLoaded(cls, attr, parent=None):
+		node = super(MTaskNode, cls)._createLoaded(attr, parent)
+		node.__childIndex = None
+		node.__nameCounters = None
+		node.__pathCache = None
+		node.addObserver(node, events=cls.__ownEvents)
+		if parent:
+			node.addObserver(parent, events=cls.__childEvents)
+		return node
+
+	def delete(self):
+		_callAsUndoStep(self, super(MTaskNode, self).delete)
 
 	def setName(self, name):
 		return self.setAttr('name', name)
@@ -228,40 +665,270 @@ class MTaskNode(TreeNode):
 		return self.getAttr('name')
 
 	def getPathStr(self):
+		pathCache = self.__pathCache
+		if pathCache and pathCache[0] == MTaskNode.__pathGeneration:
+			return pathCache[1]
+
 		parent = self.getParent()
 		parentPath = parent.getPathStr() if parent else ''
 		if parentPath != '/':
 			parentPath += '/'
-		return parentPath + self.getName()
+		path = parentPath + self.getName()
+		self.__pathCache = (MTaskNode.__pathGeneration, path)
+		return path
 
 	def isNode(self):
 		return True
 
 	def getChild(self, childName):
-		childNameToObjMap = [(x.getName(), x) for x in self.getChildren() if isinstance(x, MTaskNode)]
-		childNameToObjMap = dict(childNameToObjMap)
-		return childNameToObjMap.get(childName)
+		children = self.__getChildIndex().get(childName)
+		return children[-1] if children else None
+
+	def getFreeChildName(self, prefix):
+		"""
+		Returns prefix followed by the smallest number no MTaskNode child is named with, eg. 'task0'.
+		Amortized O(1), the name is not reserved until a child gets it
+		"""
+		childIndex = self.__getChildIndex()
+		if self.__nameCounters is None:
+			self.__nameCounters = {}
+
+		# Numbers below counter are taken or in freeNumbers(heap), which may have ones taken again since
+		counter = self.__nameCounters.setdefault(prefix, [0, []])
+		freeNumbers = counter[1]
+		while freeNumbers:
+			name = prefix + str(freeNumbers[0])
+			if name not in childIndex:
+				return name
+			heapq.heappop(freeNumbers)
+
+		while prefix + str(counter[0]) in childIndex:
+			counter[0] += 1
+		return prefix + str(counter[0])
+
+	@staticmethod
+	def splitNameNumber(name):
+		"""
+		Returns (prefix, number) eg. ('task', 12) for 'task12', number is None if name doesn't end with digits
+		"""
+		prefix = name
+		while prefix and prefix[-1].isdigit():
+			prefix = prefix[:-1]
+		if prefix == name:
+			return name, None
+		return prefix, int(name[len(prefix):])
+
+	def __getChildIndex(self):
+		if self.__childIndex is None:
+			children = self.getChildren()
+			self.__childIndex = {}
+			self.__nameCounters = None
+			for child in children:
+				self.__addToChildIndex(child)
+		return self.__childIndex
+
+	def __addToChildIndex(self, child, name=None):
+		if isinstance(child, MTaskNode):
+			name = child.getAttrDefault('name') if name is None else name
+			if name is not None:
+				self.__childIndex.setdefault(name, []).append(child)
+
+	def __removeFromChildIndex(self, child, name=None):
+		name = child.getAttrDefault('name') if name is None else name
+		children = self.__childIndex.get(name)
+		if children and child in children:
+			children.remove(child)
+			if not children:
+				del self.__childIndex[name]
+				self.__freeName(name)
+
+	def __freeName(self, name):
+		if not self.__nameCounters:
+			return
+		prefix, number = self.splitNameNumber(name)
+		counter = self.__nameCounters.get(prefix)
+		# 'task007' doesn't take 7
+		if counter and number is not None and number < counter[0] and prefix + str(number) == name:
+			heapq.heappush(counter[1], number)
+
+	def __updateChildIndex(self, notifier, event, data):
+		if event == 'attrChanged':
+			if notifier.getParent() is self:
+				attrName, oldValue, newValue = data
+				if oldValue is not NOT_EXIST:
+					self.__removeFromChildIndex(notifier, oldValue)
+				self.__addToChildIndex(notifier, newValue)
+		elif event == 'childAdded':
+			self.__addToChildIndex(data)
+		elif event == 'childRemoved':
+			self.__removeFromChildIndex(data)
+
+	def _revive(self):
+		super(MTaskNode, self)._revive()
+		self.addObserver(self, events=self.__ownEvents)
 
 	def setParent(self, parent):
+		_callAsUndoStep(self, self.__setParent, parent)
+
+	def __setParent(self, parent):
 		oldParent = self.getParent()
 		super(MTaskNode, self).setParent(parent)
+		if oldParent != parent:
+			MTaskNode.__pathGeneration += 1
 		if oldParent:
 			self.removeObserver(oldParent)
 		if parent:
-			self.addObserver(parent)
+			self.addObserver(parent, events=self.__childEvents)
+
+	def restoreSnapshot(self, snapshot):
+		# Snapshots have the roll-ups already, and the pending deltas are of the changes being undone
+		MTaskNode.__pendingRollUpDeltas.clear()
+		del MTaskNode.__pendingRollUpHeap[:]
+		MTaskNode.__isRestoringSnapshot = True
+		try:
+			return super(MTaskNode, self).restoreSnapshot(snapshot)
+		finally:
+			MTaskNode.__isRestoringSnapshot = False
 
 	def _onNotify(self, notifier, event, data):
-		if notifier in self.getChildren() and event == 'attrChanged' and data[0] == 'actual':
-			self.__updateActual()
-		if notifier == self and (event == 'childRemoved' or event == 'childAdded'):
-			self.__updateActual()
-
-	def __updateActual(self):
-		sumChildActuals = 0
-		for child in self.getChildren():
-			if child.hasAttr('actual'):
-				sumChildActuals += child.getAttr('actual')
-		self.setAttr('actual', sumChildActuals)
+		if self.__childIndex is not None and (event != 'attrChanged' or data[0] == 'name'):
+			self.__updateChildIndex(notifier, event, data)
+		if notifier is self and event == 'attrChanged' and data[0] == 'name':
+			MTaskNode.__pathGeneration += 1
+
+		# Only roll-ups below
+		if MTaskNode.__isRestoringSnapshot:
+			return
+
+		if event == 'attrChanged':
+			attrName, oldValue, newValue = data
+			if notifier.getParent() is self:
+				if attrName in self.__rollUpNames:
+					self.__addRollUp(attrName, self.__toNumber(newValue) - self.__toNumber(oldValue))
+			elif notifier is self and not self.hasChildren():
+				for rollUpName, sourceName, leafValue in self.__rollUps:
+					if sourceName == attrName and leafValue:
+						self.__setRollUp(rollUpName, leafValue(newValue))
+		elif notifier is self and event == 'childAdded':
+			isFirstChild = self.getChildCount() == 1
+			for rollUpName, sourceName, leafValue in self.__rollUps:
+				value = data.getAttrDefault(rollUpName, 0)
+				if isFirstChild:
+					self.__setRollUp(rollUpName, value)
+				else:
+					self.__addRollUp(rollUpName, value)
+		elif notifier is self and event == 'childRemoved':
+			isLastChild = not self.hasChildren()
+			for rollUpName, sourceName, leafValue in self.__rollUps:
+				if isLastChild:
+					self.__setRollUp(rollUpName, leafValue(self.getAttr(sourceName)) if leafValue else 0)
+				else:
+					self.__addRollUp(rollUpName, -data.getAttrDefault(rollUpName, 0))
+
+	@staticmethod
+	def __toNumber(value):
+		return 0 if value is NOT_EXIST else value
+
+	def __addRollUp(self, attrName, delta):
+		if not delta:
+			return
+
+		if not MTaskNode.__rollUpBatchDepth:
+			self.setAttr(attrName, self.getAttrDefault(attrName, 0) + delta)
+			return
+
+		deltas = MTaskNode.__pendingRollUpDeltas.get(self)
+		if deltas is None:
+			deltas = MTaskNode.__pendingRollUpDeltas[self] = {}
+			heapq.heappush(MTaskNode.__pendingRollUpHeap, (-self.__getDepth(), id(self), self))
+		deltas[attrName] = deltas.get(attrName, 0) + delta
+
+	def __setRollUp(self, attrName, value):
+		# Overrides the deltas added so far
+		deltas = MTaskNode.__pendingRollUpDeltas.get(self)
+		if deltas:
+			deltas.pop(attrName, None)
+		if self.getAttrDefault(attrName, NOT_EXIST) != value:
+			self.setAttr(attrName, value)
+
+	def __getDepth(self):
+		depth = 0
+		parent = self.getParent()
+		while parent:
+			depth += 1
+			parent = parent.getParent()
+		return depth
+
+	@staticmethod
+	def beginRollUpBatch():
+		"""
+		Roll-ups of the ancestors are updated once at the matching endRollUpBatch() call
+		instead of at every change of the descendants. Can be nested
+		"""
+		MTaskNode.__rollUpBatchDepth += 1
+
+	@staticmethod
+	def endRollUpBatch():
+		assert(MTaskNode.__rollUpBatchDepth > 0)
+		try:
+			if MTaskNode.__rollUpBatchDepth == 1:
+				MTaskNode.__flushRollUps()
+		finally:
+			MTaskNode.__rollUpBatchDepth -= 1
+
+	@staticmethod
+	def __flushRollUps():
+		# The deepest first, the deltas added to the parent while doing so are merged into the parent's
+		pendingDeltas = MTaskNode.__pendingRollUpDeltas
+		pendingHeap = MTaskNode.__pendingRollUpHeap
+		while pendingHeap:
+			depth, nodeId, node = heapq.heappop(pendingHeap)
+			deltas = pendingDeltas.pop(node)
+			if node.isDeleted():
+				continue
+			for attrName, delta in deltas.items():
+				if delta:
+					node.setAttr(attrName, node.getAttrDefault(attrName, 0) + delta)
+
+	def updateRollUps(self):
+		"""
+		Compute the roll-ups of the subtree from scratch, for nodes saved before they existed
+		"""
+		nodes = []
+		stack = [self]
+		while stack:
+			node = stack.pop()
+			nodes.append(node)
+			stack.extend(x for x in node.getChildren() if isinstance(x, MTaskNode))
+
+		MTaskNode.beginRollUpBatch()
+		try:
+			for node in reversed(nodes):
+				children = node.getChildren()
+				for rollUpName, sourceName, leafValue in node.__rollUps:
+					if children:
+						value = sum([x.getAttrDefault(rollUpName, 0) for x in children])
+					elif leafValue:
+						value = leafValue(node.getAttr(sourceName))
+					else:
+						continue
+					node.__setRollUp(rollUpName, value)
+		finally:
+			MTaskNode.endRollUpBatch()
+
+	def __getstate__(self):
+		d = super(MTaskNode, self).__getstate__()
+		# Caches are built again as needed
+		d['_MTaskNode__childIndex'] = None
+		d['_MTaskNode__nameCounters'] = None
+		d['_MTaskNode__pathCache'] = None
+		return d
+
+	def __setstate__(self, d):
+		super(MTaskNode, self).__setstate__(d)
+		self.__childIndex = None
+		self.__nameCounters = None
+		self.__pathCache = None
 
 # ------------------------------------------------------
 class MTaskDotNode(TreeNode):
@@ -269,6 +936,12 @@ class MTaskDotNode(TreeNode):
 		super(MTaskDotNode, self).__init__(parent)
 		self.setAttr('pos', (0, 0))
 
+	def delete(self):
+		_callAsUndoStep(self, super(MTaskDotNode, self).delete)
+
+	def setParent(self, parent):
+		_callAsUndoStep(self, super(MTaskDotNode, self).setParent, parent)
+
 	def isNode(self):
 		return True
 
@@ -290,17 +963,17 @@ class MTaskConnection(Observable):
 		return False
 
 	def delete(self):
+		_callAsUndoStep(self, self.__delete)
+
+	def __delete(self):
 		self._notify('deleted')
 		self.clearObservers()
 
 	def __getstate__(self):
-		d = self.__dict__.copy()
+		d = super(MTaskConnection, self).__getstate__()
 		d['_Observable__observers'] = []
 		return d
 
-	def __setstate__(self, d):
-		self.__dict__ = d
-
 # ======================================================
 
 if __name__ == '__main__':
@@ -331,3 +1004,97 @@ if __name__ == '__main__':
 		assert(pt1.getAttr('actual') == 4.0)
 		gt1.setParent(None)
 		assert(pt1.getAttr('actual') == 0.0)
+
+	def undoDeleteTest():
+		# A deletion outside undo groups is undone at once, with the connections deleted with it
+		model = MTaskModel()
+		a = model.createTaskNode(model.getRoot())
+		b = model.createTaskNode(model.getRoot())
+		c = model.createTaskDotNode(model.getRoot())
+		model.createTaskConnection(a, b)
+		model.createTaskConnection(c, b)
+
+		b.delete()
+		assert(not model.getConnections())
+		model.undo()
+		assert(not b.isDeleted() and b.getParent() == model.getRoot())
+		assert(len(model.getConnections()) == 2)
+		for connection in model.getConnections():
+			assert(not connection.getFrom().isDeleted() and not connection.getTo().isDeleted())
+
+		c.delete()
+		model.getConnections()[0].delete()
+		model.undo()
+		assert(len(model.getConnections()) == 1)
+		model.undo()
+		assert(not c.isDeleted() and len(model.getConnections()) == 2)
+
+	def undoAttrTest():
+		# Changes of another node are undone separately though they change the same roll-ups
+		model = MTaskModel()
+		a = model.createTaskNode(model.getRoot())
+		b = model.createTaskNode(model.getRoot())
+
+		a.setAttr('estimated', 1)
+		a.setAttr('estimated', 2) # Merged
+		b.setAttr('estimated', 3)
+		a.setAttr('status', 'done')
+		b.setAttr('status', 'done')
+		model.undo()
+		assert(b.getAttr('status') == 'waiting' and a.getAttr('status') == 'done')
+		model.undo()
+		assert(a.getAttr('status') == 'waiting' and model.getRoot().getAttr('doneCount') == 0)
+		model.undo()
+		assert(b.getAttr('estimated') == 0 and a.getAttr('estimated') == 2)
+		assert(model.getRoot().getAttr('estimatedTotal') == 2)
+		model.undo()
+		assert(a.getAttr('estimated') == 0 and model.getRoot().getAttr('estimatedTotal') == 0)
+
+	def undoReparentTest():
+		# Moving a node outside undo groups is undone at once, with the roll-ups it changed
+		model = MTaskModel()
+		a = model.createTaskNode(model.getRoot())
+		b = model.createTaskNode(model.getRoot())
+		c = model.createTaskNode(a)
+		c.setAttr('estimated', 5)
+
+		c.setParent(b)
+		assert(a.getAttr('estimatedTotal') == 0 and b.getAttr('estimatedTotal') == 5)
+		model.undo()
+		assert(not c.isDeleted() and c.getParent() == a and c in a.getChildren() and not b.getChildren())
+		assert(a.getAttr('estimatedTotal') == 5 and b.getAttr('estimatedTotal') == 0)
+		assert(c.getAttr('estimated') == 5)
+		model.undo()
+		assert(c.getAttr('estimated') == 0 and a.getAttr('estimatedTotal') == 0)
+
+	def dumpTest():
+		# Values keep their types through the file though ints and floats are mixed in an attribute
+		model = MTaskModel()
+		a = model.createTaskNode(model.getRoot())
+		b = model.createTaskNode(model.getRoot())
+		a.setAttr('actual', 1.5)
+		a.setAttr('pos', (10.5, 20.0))
+		b.setAttr('size', (1, 2.5))
+		records = model.getDumpRecords()
+
+		loaded = MTaskModel()
+		loaded.setDumpString(model.getDumpString())
+		assert(loaded.getDumpRecords() == records)
+		a, b = loaded.getRoot().getChildren()
+		assert(type(a.getAttr('actual')) is float and type(b.getAttr('actual')) is int)
+		assert(type(a.getAttr('estimated')) is int and type(b.getAttr('pos')[0]) is int)
+
+	# Convert a file saved by an older version to the current file format;
+	#	python taskModel.py example.tkpickle example.tkdata
+	import sys
+	if len(sys.argv) == 3:
+		import taskModel # Pickled nodes refer to taskModel classes, not __main__ ones
+		model = taskModel.MTaskModel()
+		model.load(sys.argv[1])
+		model.save(sys.argv[2])
+	else:
+		nodeTest()
+		undoDeleteTest()
+		undoAttrTest()
+		undoReparentTest()
+		dumpTest()
@@ -1,7 +1,11 @@
 # Timekeeper GUI node
 
-from Qt import QtCore, QtGui, QtWidgets, QtCompat
-from utils.mergeableDict import DynamicMergeableDict
+import os
+import inspect
+from Qt import QtCore, QtGui, QtWidgets
+from utils.mergeableDict import FrozenMergedDict
+from utils.uiTemplate import UiTemplate
+from utils.observable import Observable
 from nodeViewFramework.paintStyle import PaintStyle
 from nodeViewFramework.frameworkMain import GCanvas, GRectNode, GDotNode, GConnection
 from taskModel import MTaskNode, MTaskDotNode
@@ -13,13 +17,25 @@ class GTaskCanvas(GCanvas):
 	Kind of ad-hoc canvas class for timeKeeper application
 	"""
 
+	__modelEvents = frozenset(['createTask', 'createDot', 'createConnection', 'deleteTaskNode', 'changeRoot', 'renameTaskNode'])
+
+	__openCanvases = set() # Canvases are kept until their views are closed
+
 	def __init__(self, mTaskModel, rootMTaskNode=None, *args, **kargs):
 		super(GTaskCanvas, self).__init__(*args, **kargs)
 		self.__mTaskModel = mTaskModel
-		mTaskModel.addObserver(self) # Observe mTask to receive node and connection creation event.
+		mTaskModel.addObserver(self, events=self.__modelEvents) # Observe mTask to receive node and connection creation event.
+
+		# Graphics items on this canvas, maintained by the items themselves through _addGItem() and _removeGItem()
+		self.__mToGNode = {} # {mNode: gNode}
+		self.__mToGConnection = {} # {mConnection: gConnection}
+		self.__widgetRequestedGNodes = set() # GTaskNodes to create the widgets of, see _requestWidgets()
+
+		self.__isMouseUndoGroupOpen = False
 		view = self.views()[0]
 		view.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
 		view.destroyed.connect(self.__onDestroyed)
+		GTaskCanvas.__openCanvases.add(self) # The model doesn't keep its observers alive
 
 		if rootMTaskNode:
 			self.__rootMTaskNode = rootMTaskNode
@@ -30,15 +46,31 @@ class GTaskCanvas(GCanvas):
 
 		view.resize(1000, 600)
 
+	def __repaintView(self):
+		self.views()[0].viewport().update()
+
 	def drawBackground(self, painter, rect):
-		pathStr = self.__rootMTaskNode.getPathStr()
-		font = QtGui.QFont()
+		# rect is only the part being repainted, the path is at the top left of the view
+		view = self.views()[0]
+		rect = view.mapToScene(view.viewport().rect()).boundingRect()
 		pen = QtGui.QPen()
 		pen.setColor(QtGui.QColor(200, 200, 200, 255))
 		painter.setPen(pen)
+		painter.setFont(self.__getPathFont())
+		painter.drawText(rect, self.__rootMTaskNode.getPathStr())
+
+	def _getViewAnchoredRect(self, view):
+		# The path drawn by drawBackground(), which wraps it within the rect as QTextOption() does by default
+		rect = view.mapToScene(view.viewport().rect()).boundingRect()
+		metrics = QtGui.QFontMetricsF(self.__getPathFont())
+		textRect = metrics.boundingRect(rect, QtCore.Qt.TextWordWrap, self.__rootMTaskNode.getPathStr())
+		return view.mapFromScene(textRect).boundingRect().adjusted(-2, -2, 2, 2)
+
+	@staticmethod
+	def __getPathFont():
+		font = QtGui.QFont()
 		font.setPointSize(25)
-		painter.setFont(font)
-		painter.drawText(rect, pathStr)
+		return font
 
 	def keyPressEvent(self, event):
 
@@ -46,6 +78,14 @@ class GTaskCanvas(GCanvas):
 			super(GTaskCanvas, self).keyPressEvent(event)
 			return
 
+		# Changes made by a command are undone at once
+		self.__mTaskModel.beginUndoGroup()
+		try:
+			self.__onCommandKeyPressed(event)
+		finally:
+			self.__mTaskModel.endUndoGroup()
+
+	def __onCommandKeyPressed(self, event):
 		view = self.views()[0]
 		sPos = view.mapToScene(view.mapFromGlobal(QtGui.QCursor.pos()))
 		pos = sPos.x(), sPos.y()
@@ -55,6 +95,9 @@ class GTaskCanvas(GCanvas):
 		elif event.key() == QtCore.Qt.Key_N: # Node
 			node = self.__mTaskModel.createTaskNode(self.__rootMTaskNode)
 			node.setAttr('pos', pos)
+			gNode = self.__mToGNode.get(node)
+			if gNode:
+				gNode.editDescription()
 		elif event.key() == QtCore.Qt.Key_D: # Dot
 			node = self.__mTaskModel.createTaskDotNode(self.__rootMTaskNode)
 			node.setAttr('pos', pos)
@@ -63,11 +106,11 @@ class GTaskCanvas(GCanvas):
 				self.__resetNetwork(self.__rootMTaskNode.getParent())
 				self.__userSpecifiedPath = self.__rootMTaskNode.getPathStr()
 		elif event.key() == QtCore.Qt.Key_S: # Save
-			filePath = QtWidgets.QFileDialog.getSaveFileName(None, 'Save File', filter=("time keeper (*.tkpickle)"))
+			filePath = QtWidgets.QFileDialog.getSaveFileName(None, 'Save File', filter=("time keeper (*.tkdata)"))
 			if filePath[0]:
 				self.__mTaskModel.save(filePath[0])
 		elif event.key() == QtCore.Qt.Key_O: # Open
-			filePath = QtWidgets.QFileDialog.getOpenFileName(None, 'Open file', filter=("TimeKeeper (*.tkpickle)"))
+			filePath = QtWidgets.QFileDialog.getOpenFileName(None, 'Open file', filter=("TimeKeeper (*.tkdata *.tkpickle)"))
 			if filePath[0]:
 				self.__mTaskModel.load(filePath[0])
 				pathNode = self.__getPathNode(self.__userSpecifiedPath)
@@ -96,15 +139,23 @@ class GTaskCanvas(GCanvas):
 				return
 			mNodes, mConnections = pasteItems
 			self.clearSelection()
-			mToGMapND, mToGMapC = self.__getMItemToGItemMap()
 			for mNode in mNodes:
-				gNode = mToGMapND.get(mNode)
+				gNode = self.__mToGNode.get(mNode)
 				if gNode:
 					gNode.setSelected(True)
 			for mConnection in mConnections:
-				gConnection = mToGMapC.get(mConnection)
+				gConnection = self.__mToGConnection.get(mConnection)
 				if gConnection:
 					gConnection.setSelected(True)
+		elif event.key() in [QtCore.Qt.Key_Z, QtCore.Qt.Key_Y]: # Undo, Redo
+			item = self.itemAt(sPos.toPoint(), QtGui.QTransform())
+			if item and isinstance(item, QtWidgets.QGraphicsProxyWidget):
+				super(GTaskCanvas, self).keyPressEvent(event)
+				return
+			if event.key() == QtCore.Qt.Key_Z:
+				self.__mTaskModel.undo()
+			else:
+				self.__mTaskModel.redo()
 		elif event.key() == QtCore.Qt.Key_W: # Window
 			newCanvas = GTaskCanvas(self.__mTaskModel, self.__rootMTaskNode)
 			newCanvas.show()
@@ -149,8 +200,6 @@ class GTaskCanvas(GCanvas):
 			super(GTaskCanvas, self).keyPressEvent(event)
 			return
 
-		self.update()
-
 	def __deleteSelected(self):
 		while self.selectedItems():
 			self.selectedItems()[0].delete()
@@ -161,6 +210,29 @@ class GTaskCanvas(GCanvas):
 		selectedNodes = [x for x in selectedItems if isinstance(x, (MTaskNode, MTaskDotNode))]
 		self.__mTaskModel.copy(selectedNodes)
 
+	def mousePressEvent(self, event):
+		# Changes made by a mouse drag are undone at once
+		if not self.__isMouseUndoGroupOpen:
+			self.__mTaskModel.beginUndoGroup()
+			self.__isMouseUndoGroupOpen = True
+		super(GTaskCanvas, self).mousePressEvent(event)
+
+	def mouseMoveEvent(self, event):
+		# Nodes dragged together update the views once
+		Observable.beginNotifyBatch()
+		try:
+			super(GTaskCanvas, self).mouseMoveEvent(event)
+		finally:
+			Observable.endNotifyBatch()
+
+	def mouseReleaseEvent(self, event):
+		try:
+			super(GTaskCanvas, self).mouseReleaseEvent(event)
+		finally:
+			if self.__isMouseUndoGroupOpen:
+				self.__isMouseUndoGroupOpen = False
+				self.__mTaskModel.endUndoGroup()
+
 	def mouseDoubleClickEvent(self, event):
 		itemFrom = self.itemAt(event.scenePos().toPoint(), QtGui.QTransform())
 		if isinstance(itemFrom, GTaskNode):
@@ -184,8 +256,6 @@ class GTaskCanvas(GCanvas):
 		"""
 		Make this canvas show the network under rootTaskNode
 		"""
-		self.clear()
-
 		if rootMTaskNode:
 			p = rootMTaskNode
 			while p:
@@ -198,11 +268,91 @@ class GTaskCanvas(GCanvas):
 			rootMTaskNode = self.__mTaskModel.getInvalidNode()
 
 		self.__rootMTaskNode = rootMTaskNode
+		self.clearSelection()
 		connections = self.__mTaskModel.getConnections(rootMTaskNode)
-		self.__addNetwork(rootMTaskNode.getChildren(), connections)
+		self.__reconcileNetwork(rootMTaskNode.getChildren(), connections)
 
 		self.update()
 
+	def __reconcileNetwork(self, mNodes, mConnections):
+		"""
+		Make the canvas show exactly the given network, reusing the graphics items already on the canvas.
+		A graphics item is matched with a model item in this order;
+			- the graphics item for the same model item is kept as it is
+			- a task node showing a model node of the same name is rebound (eg. the model is reloaded)
+			- any unused graphics item of the same class is rebound
+		A connection is kept or rebound if it already connects the right graphics nodes.
+		Graphics items left unmatched are removed and missing ones are created.
+		"""
+		# Nodes
+
+		mToGNode = {} # {mNode: gNode} for mNodes that already have a graphics node to show them
+		mNodeSet = set(mNodes)
+		spareGNodes = set()
+		for mNode, gNode in self.__mToGNode.items():
+			if mNode in mNodeSet:
+				mToGNode[mNode] = gNode
+			else:
+				spareGNodes.add(gNode)
+
+		nameToSpareGNode = dict((x.getMItem().getName(), x) for x in spareGNodes if isinstance(x, GTaskNode))
+		for mNode in mNodes:
+			if mNode in mToGNode or not isinstance(mNode, MTaskNode):
+				continue
+			gNode = nameToSpareGNode.pop(mNode.getName(), None)
+			if gNode:
+				spareGNodes.remove(gNode)
+				gNode._setMItem(mNode)
+				mToGNode[mNode] = gNode
+
+		classToSpareGNodes = {GTaskNode : [], GTaskDotNode : []}
+		for gNode in spareGNodes:
+			classToSpareGNodes[gNode.__class__].append(gNode)
+
+		mNodesToCreate = []
+		for mNode in mNodes:
+			if mNode in mToGNode:
+				continue
+			spares = classToSpareGNodes[self.__getGNodeClass(mNode)]
+			if spares:
+				gNode = spares.pop()
+				gNode._setMItem(mNode)
+				mToGNode[mNode] = gNode
+			else:
+				mNodesToCreate.append(mNode)
+
+		# Connections
+
+		gConnections = self.__mToGConnection.values()
+
+		pairToGConnection = {} # {(gNodeFrom, gNodeTo): gConnection}
+		for gConnection in gConnections:
+			pairToGConnection[gConnection.getNodes()] = gConnection
+
+		keptGConnections = set()
+		mConnectionsToCreate = []
+		for mConnection in mConnections:
+			gNodeFrom = mToGNode.get(mConnection.getFrom())
+			gNodeTo = mToGNode.get(mConnection.getTo())
+			gConnection = pairToGConnection.get((gNodeFrom, gNodeTo)) if gNodeFrom and gNodeTo else None
+			if gConnection and gConnection not in keptGConnections:
+				if gConnection.getMItem() != mConnection:
+					gConnection._setMItem(mConnection)
+				keptGConnections.add(gConnection)
+			else:
+				mConnectionsToCreate.append(mConnection)
+
+		# Remove unused items. Connections first as they refer to nodes
+
+		for gConnection in gConnections:
+			if gConnection not in keptGConnections:
+				gConnection._discard()
+		for spares in classToSpareGNodes.values():
+			for gNode in spares:
+				gNode._discard()
+
+		self.__addNetwork(mNodesToCreate, mConnectionsToCreate)
+
 	def __jumpTopath(self, path='/'):
 		node = self.__getPathNode(path)
 		if node:
@@ -224,6 +374,14 @@ class GTaskCanvas(GCanvas):
 
 		return node
 
+	@staticmethod
+	def __isAncestorOrSelf(mNode, descendant):
+		p = descendant
+		while p:
+			if p == mNode:
+				return True
+			p = p.getParent()
+		return False
 
 	def __addNetwork(self, mNodes, mConnections):
 		"""
@@ -232,27 +390,17 @@ class GTaskCanvas(GCanvas):
 		connections where either of the node is not a direct child of current root Mnode are ignored
 		"""
 
-		mToGMapND, mToGMapC = self.__getMItemToGItemMap()
-
-		# Used to find the appropriate GNode sub class for each mNode
-		classMapper = {
-			MTaskNode : GTaskNode,
-			MTaskDotNode : GTaskDotNode,
-			}
-
 		for mNode in mNodes:
 
 			if mNode.getParent() != self.__rootMTaskNode:
 				continue
 
-			gNode = mToGMapND.get(mNode)
+			gNode = self.__mToGNode.get(mNode)
 			if gNode:
 				continue # Already exists
 
-			gNodeClass = classMapper[mNode.__class__]
-			gNode = gNodeClass(self, mNode) # instanciate GNode sub class instance for the mNode
-
-			mToGMapND[mNode] = gNode
+			gNodeClass = self.__getGNodeClass(mNode)
+			gNodeClass(self, mNode) # instanciate GNode sub class instance for the mNode, it registers itself
 
 		for mConnection in mConnections:
 			mNodeFrom = mConnection.getFrom()
@@ -267,25 +415,49 @@ class GTaskCanvas(GCanvas):
 			if mNodeFrom.getParent() != self.__rootMTaskNode:
 				continue
 
-			gNodeFrom = mToGMapND.get(mNodeFrom)
-			gNodeTo = mToGMapND.get(mNodeTo)
+			gNodeFrom = self.__mToGNode.get(mNodeFrom)
+			gNodeTo = self.__mToGNode.get(mNodeTo)
 
 			assert(gNodeFrom and gNodeTo)
 
 			GTaskConnection(self, mConnection) # instanciate GConnection sub class instance for the mConnection
 
-	def __getMItemToGItemMap(self):
+	@staticmethod
+	def __getGNodeClass(mNode):
+		# Used to find the appropriate GNode sub class for each mNode
+		return {
+			MTaskNode : GTaskNode,
+			MTaskDotNode : GTaskDotNode,
+			}[mNode.__class__]
 
-		def createMap(gItemClass):
-			gItems = [x for x in self.items() if isinstance(x, gItemClass)]
-			gToMList = [(x.getMItem(), x) for x in gItems]
-			return dict(gToMList)
+	def _addGItem(self, gItem):
+		"""
+		Graphics items call this when they start showing a model item
+		"""
+		self.__getMToGItemMap(gItem)[gItem.getMItem()] = gItem
 
-		mToGMapND = createMap(GTaskNode)
-		mToGMapND.update(createMap(GTaskDotNode))
-		mToGMapC = createMap(GConnection)
+	def _removeGItem(self, gItem):
+		"""
+		Graphics items call this when they stop showing a model item
+		"""
+		mToGItem = self.__getMToGItemMap(gItem)
+		mItem = gItem.getMItem()
+		if mToGItem.get(mItem) == gItem:
+			del mToGItem[mItem]
+
+	def _findGItem(self, mItem):
+		"""
+		Returns the graphics item that shows mItem on this canvas, or None
+		"""
+		gItem = self.__mToGNode.get(mItem)
+		if gItem:
+			return gItem
+		return self.__mToGConnection.get(mItem)
 
-		return mToGMapND, mToGMapC
+	def __getMToGItemMap(self, gItem):
+		if isinstance(gItem, GConnection):
+			return self.__mToGConnection
+		return self.__mToGNode
 
 	def _onNotify(self, notifier, event, data):
 		if event in ['createTask', 'createDot']:
@@ -299,10 +471,39 @@ class GTaskCanvas(GCanvas):
 			self.__jumpTopath(self.__userSpecifiedPath)
 		elif event == 'renameTaskNode':
 			pathNode = self.__getPathNode(self.__userSpecifiedPath)
-			self.update()
+			gNode = self.__mToGNode.get(data)
+			if gNode:
+				gNode.update()
+			if self.__isAncestorOrSelf(data, self.__rootMTaskNode):
+				self.__repaintView() # The path shown is changed
 			if pathNode:
 				self.__userSpecifiedPath = pathNode.getPathStr()
 
+	def _onDetailChanged(self):
+		for gNode in self.__mToGNode.values():
+			if isinstance(gNode, GTaskNode):
+				gNode._onCanvasDetailChanged()
+		super(GTaskCanvas, self)._onDetailChanged()
+
+	def _requestWidgets(self, gTaskNode):
+		"""
+		GTaskNodes call this when they are drawn without the widgets they should show.
+		The widgets are created after painting, together for the nodes drawn at once
+		"""
+		if not self.__widgetRequestedGNodes:
+			QtCore.QTimer.singleShot(0, self.__createRequestedWidgets)
+		self.__widgetRequestedGNodes.add(gTaskNode)
+
+	def __createRequestedWidgets(self):
+		gNodes = self.__widgetRequestedGNodes
+		self.__widgetRequestedGNodes = set()
+		if not self.views():
+			return # Closed
+
+		for gNode in gNodes:
+			if self.__mToGNode.get(gNode.getMItem()) is gNode: # Not deleted or discarded since
+				gNode._updateWidgets()
+
 	def _createConnection(self, gNodeFrom, gNodeTo):
 		connectableNodeType = (GTaskNode, GTaskDotNode)
 		if isinstance(gNodeFrom, connectableNodeType) and isinstance(gNodeTo, connectableNodeType):
@@ -310,6 +511,7 @@ class GTaskCanvas(GCanvas):
 
 	def __onDestroyed(self):
 		self.__mTaskModel.removeObserver(self)
+		GTaskCanvas.__openCanvases.discard(self)
 
 	def _onTaskNodeDeleted(self, gTaskNode):
 		if gTaskNode.getMItem() == self.__rootMTaskNode:
@@ -318,47 +520,72 @@ class GTaskCanvas(GCanvas):
 
 
 # ======================================================
+# Shared by all the GTaskNode instances so that nodeLook.ui is parsed only once
+_nodeLookTemplate = UiTemplate(os.path.join(os.path.dirname(inspect.getabsfile(GTaskCanvas)), 'nodeLook.ui'))
+
+# ------------------------------------------------------
 class GTaskNode(GRectNode):
 
-	__waitingBgColors = {
-		'col' : [240, 240, 240, 255],
-		'colSel' : [240, 240, 240, 255],
-		}
-	__wipBgColors = {
-		'col' : [255, 200, 200, 255],
-		'colSel' : [255, 200, 200, 255],
-		}
-	__doneBgColors = {
-		'col' : [150, 150, 150, 255],
-		'colSel' : [150, 150, 150, 255],
+	# Styles of the status, shared by all the nodes (see _getPaintStyle())
+	_variantStyles = {
+		'waiting' : {
+			'bgPaint' : {
+				'col' : [240, 240, 240, 255],
+				'colSel' : [240, 240, 240, 255],
+				}
+			},
+		'wip' : {
+			'bgPaint' : {
+				'col' : [255, 200, 200, 255],
+				'colSel' : [255, 200, 200, 255],
+				}
+			},
+		'done' : {
+			'bgPaint' : {
+				'col' : [150, 150, 150, 255],
+				'colSel' : [150, 150, 150, 255],
+				}
+			},
 		}
 
-	__style = {
-		'bgPaint' : __waitingBgColors,
-		}
+	_config = FrozenMergedDict(GRectNode._config, shapeRoundRadius=1)
+
+	# Bars of estimated and actual drawn instead of the widgets (see paint())
+	__estimatedBarColor = QtGui.QColor(100, 150, 220)
+	__actualBarColor = QtGui.QColor(90, 180, 90)
+	__overActualBarColor = QtGui.QColor(220, 80, 80)
+	__barHeight = 4
+	__barSpacing = 2
 
-	_config = DynamicMergeableDict(shapeRoundRadius=1)
-	_config.setBase(GRectNode._config)
+	__minSize = None # Size of the node with the widgets, shared so that a node is the same size without them
+
+	# Events of the model node shown, see _onNotify()
+	__mNodeEvents = frozenset([('attrChanged', x) for x in ['actual', 'estimated', 'description', 'pos', 'size', 'status']]
+		+ ['deleted', 'childAdded', 'childRemoved'])
 
 	def __init__(self, canvas, mTaskNode):
 		super(GTaskNode, self).__init__(canvas)
 
-		self._paintStyle = PaintStyle(self.__style, False)
-		self._paintStyle.setBaseStyle(GRectNode._paintStyle)
-
 		self.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
 		self.destroyed.connect(self.__onDestroyed)
 
 		self.__mNode = mTaskNode
-		mTaskNode.addObserver(self)
-
-		self.__loadUiFile()
-		self.__setInitNodeState()
-		self.__connectSignalSlot()
-
+		mTaskNode.addObserver(self, isDeferred=True, events=self.__mNodeEvents) # Only reflects the model node
+		self.__status = mTaskNode.getAttr('status')
+		canvas._addGItem(self)
+
+		# The widgets are created when the node is drawn in detail or focused for the first time (see paint())
+		self.__ui = None
+		self.__isHovered = False
+		self.__hasFocus = False
 		self.__processingAttrNames = set()
 		self.__isDescriptionChanging = False
 
+		self.setMinimumSize(self.__getMinSize())
+		self.setCacheMode(QtWidgets.QGraphicsItem.DeviceCoordinateCache)
+		self.__setInitNodeState()
+		self.geometryChanged.connect(self.__onGeometryChanged)
+
 	def getMItem(self):
 		return self.__mNode
 
@@ -368,35 +595,115 @@ class GTaskNode(GRectNode):
 		# This GTaskNode instance is deleted when the model node deletion is observed
 		self.__mNode.delete()
 
-	def __loadUiFile(self):
-		import os, inspect
-		dirname = os.path.dirname(inspect.getabsfile(GTaskNode))
-		uiFilePath = os.path.join(dirname, 'nodeLook.ui')
-		self.__ui = QtCompat.loadUi(uiFilePath)
-		self.addWidget(self.__ui)
+	def _setMItem(self, mTaskNode):
+		"""
+		Make this node show another MTaskNode so that the canvas can reuse it
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		self.__mNode = mTaskNode
+		mTaskNode.addObserver(self, isDeferred=True, events=self.__mNodeEvents)
+		self.scene()._addGItem(self)
+
+		# Widget values are set from the model, don't send them back to the model
+		ui = self.__ui
+		signalSenders = [self, ui.estimatedSB, ui.actualSB, ui.descriptionTB] if ui else [self]
+		wasBlocked = [x.blockSignals(True) for x in signalSenders]
+		try:
+			self.__setInitNodeState()
+		finally:
+			for sender, blocked in zip(signalSenders, wasBlocked):
+				sender.blockSignals(blocked)
+		self.update()
+
+	def _discard(self):
+		"""
+		Remove this node from the canvas without deleting the model node
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		super(GTaskNode, self).delete()
+
+	def editDescription(self):
+		"""
+		Shows the widgets and puts the keyboard focus on the description, eg. for a new node
+		"""
+		self.__hasFocus = True # Shown so that it can take the focus
+		self._updateWidgets()
+		proxy = self.__ui.graphicsProxyWidget()
+		self.__ui.descriptionTB.setFocus()
+		proxy.setFocus()
+		if not proxy.hasFocus():
+			self.__hasFocus = False
+			self._updateWidgets()
+
+	def __getMinSize(self):
+		if GTaskNode.__minSize is None:
+			left, top, right, bottom = self._config['margins']
+			minSize = _nodeLookTemplate.create().minimumSizeHint()
+			GTaskNode.__minSize = QtCore.QSizeF(minSize.width() + left + right, minSize.height() + top + bottom)
+		return GTaskNode.__minSize
+
+	def __isShowingWidgets(self):
+		return self.__isHovered or self.__hasFocus or self.scene().isDetailed()
+
+	def __createWidgets(self):
+		if self.__ui:
+			return
+
+		self.__ui = ui = _nodeLookTemplate.create()
+		self.addWidget(ui)
+		ui.graphicsProxyWidget().installSceneEventFilter(self)
+		self.__setWidgetValues()
+		ui.estimatedSB.valueChanged.connect(self.__onEstimatedChanged)
+		ui.actualSB.valueChanged.connect(self.__onActualChanged)
+		ui.descriptionTB.textChanged.connect(self.__onDescriptionChanged)
+		self.update()
+
+	def _updateWidgets(self):
+		"""
+		Shows or hides the widgets depending on the zoom and the focus, creates them if they are shown first time
+		"""
+		isShowing = self.__isShowingWidgets()
+		if isShowing:
+			self.__createWidgets()
+		elif not self.__ui:
+			return
+
+		proxy = self.__ui.graphicsProxyWidget()
+		if proxy.isVisible() != isShowing:
+			proxy.setVisible(isShowing)
+			self.update() # The bars are drawn instead
+
+	def _onCanvasDetailChanged(self):
+		if self.__ui:
+			self._updateWidgets()
+		else:
+			self.update() # Widgets are created when it's drawn in detail
 
 	def __setInitNodeState(self):
 		mTaskNode = self.__mNode
-		ui = self.__ui
 		self.setPos(*mTaskNode.getAttr('pos'))
 		self.resize(*mTaskNode.getAttr('size'))
-		ui.estimatedSB.setValue(mTaskNode.getAttr('estimated'))
-		ui.actualSB.setValue(mTaskNode.getAttr('actual'))
-		ui.descriptionTB.setText(mTaskNode.getAttr('description'))
-		ui.descriptionTB.setFocus()
-		self.__setActualEnabled()
+		self.__setWidgetValues()
 		self.__setStatus()
 
-	def __connectSignalSlot(self):
+	def __setWidgetValues(self):
 		ui = self.__ui
-		ui.estimatedSB.valueChanged.connect(self.__onEstimatedChanged)
-		ui.actualSB.valueChanged.connect(self.__onActualChanged)
-		ui.descriptionTB.textChanged.connect(self.__onDescriptionChanged)
+		if not ui:
+			return
 
-		self.geometryChanged.connect(self.__onGeometryChanged)
+		# Signals are blocked by the caller or not connected yet
+		mTaskNode = self.__mNode
+		ui.estimatedSB.setValue(mTaskNode.getAttr('estimated'))
+		ui.actualSB.setValue(mTaskNode.getAttr('actual'))
+		ui.descriptionTB.setText(mTaskNode.getAttr('description'))
+		self.__setActualEnabled()
 
 	def __setActualEnabled(self):
-		hasChild = bool(self.__mNode.getChildren())
+		if not self.__ui:
+			return
+		hasChild = self.__mNode.hasChildren()
 		self.__ui.actualSB.setEnabled(not hasChild)
 		self.__ui.hasChildL.setVisible(hasChild)
 
@@ -407,6 +714,7 @@ class GTaskNode(GRectNode):
 			# The only node this object is observing is an MTaskNode which this GUI node is for
 			self.__onAttrChanged(notifier, data)
 		elif event == 'deleted':
+			self.scene()._removeGItem(self)
 			super(GTaskNode, self).delete()
 		elif event in ['childAdded', 'childRemoved']:
 			self.__setActualEnabled()
@@ -421,13 +729,18 @@ class GTaskNode(GRectNode):
 		self.__processingAttrNames.add(attrName)
 
 		try:
+			ui = self.__ui
 			if attrName == 'actual':
-				self.__ui.actualSB.setValue(newValue)
+				if ui:
+					ui.actualSB.setValue(newValue)
+				self.update()
 			elif attrName == 'estimated':
-				self.__ui.estimatedSB.setValue(newValue)
+				if ui:
+					ui.estimatedSB.setValue(newValue)
+				self.update()
 			elif attrName == 'description':
-				if not self.__isDescriptionChanging:
-					self.__ui.descriptionTB.setText(newValue)
+				if ui and not self.__isDescriptionChanging:
+					ui.descriptionTB.setText(newValue)
 			elif attrName == 'pos':
 				self.setPos(*newValue)
 			elif attrName == 'size':
@@ -438,14 +751,8 @@ class GTaskNode(GRectNode):
 			self.__processingAttrNames.remove(attrName)
 
 	def __setStatus(self):
-		newValue = self.__mNode.getAttr('status')
-		if newValue == 'waiting':
-			bgColors = self.__waitingBgColors
-		elif newValue == 'wip':
-			bgColors = self.__wipBgColors
-		elif newValue == 'done':
-			bgColors = self.__doneBgColors
-		self._paintStyle.setBgBrush(bgColors['col'], bgColors['colSel'])
+		self.__status = self.__mNode.getAttr('status')
+		self.update()
 
 	# Qt GraphicsWidget callbacks
 
@@ -474,12 +781,61 @@ class GTaskNode(GRectNode):
 	def __onDestroyed(self):
 		self.__mNode.removeObserver(self)
 
+	def _getPaintStyle(self):
+		return self._getVariantPaintStyle(self.__status)
+
 	def paint(self, painter, option, widget):
 		super(GTaskNode, self).paint(painter, option, widget)
-		self._paintStyle.applyBorderPen(painter, False)
-		self._paintStyle.applyBgBrush(painter, False)
+		paintStyle = self._getPaintStyle()
+		paintStyle.applyBorderPen(painter, False)
+		paintStyle.applyBgBrush(painter, False)
 		painter.drawText(self.boundingRect(), self.getMItem().getName())
 
+		if self.__ui and self.__ui.graphicsProxyWidget().isVisible():
+			return
+
+		self.__paintBars(painter)
+		if self.__isShowingWidgets():
+			# Not created inside paint(), the canvas creates the ones drawn together in a batch
+			self.scene()._requestWidgets(self)
+
+	def __paintBars(self, painter):
+		# Estimated and actual in proportion to the larger one, the actual is marked if it's over the estimate
+		estimated = self.__mNode.getAttr('estimated')
+		actual = self.__mNode.getAttr('actual')
+		maxValue = max(estimated, actual)
+		if maxValue <= 0:
+			return
+
+		left, top, right, bottom = self._config['margins']
+		width = self.size().width() - left - right
+		y = top + painter.fontMetrics().height()
+		painter.setPen(QtCore.Qt.NoPen)
+
+		painter.setBrush(self.__estimatedBarColor)
+		painter.drawRect(QtCore.QRectF(left, y, width * estimated / maxValue, self.__barHeight))
+
+		y += self.__barHeight + self.__barSpacing
+		painter.setBrush(self.__overActualBarColor if actual > estimated else self.__actualBarColor)
+		painter.drawRect(QtCore.QRectF(left, y, width * actual / maxValue, self.__barHeight))
+
+	def hoverEnterEvent(self, event):
+		super(GTaskNode, self).hoverEnterEvent(event)
+		self.__isHovered = True
+		self._updateWidgets()
+
+	def hoverLeaveEvent(self, event):
+		super(GTaskNode, self).hoverLeaveEvent(event)
+		self.__isHovered = False
+		self._updateWidgets()
+
+	def sceneEventFilter(self, watched, event):
+		# Focus of the widgets, which keeps them shown while editing them
+		if event.type() in [QtCore.QEvent.FocusIn, QtCore.QEvent.FocusOut]:
+			self.__hasFocus = event.type() == QtCore.QEvent.FocusIn
+			self._updateWidgets()
+		return False
+
 # ------------------------------------------------------
 class GTaskDotNode(GDotNode):
 
@@ -493,10 +849,13 @@ class GTaskDotNode(GDotNode):
 	_paintStyle = PaintStyle(__style, False)
 	_paintStyle.setBaseStyle(GDotNode._paintStyle)
 
+	__mNodeEvents = frozenset([('attrChanged', 'pos'), 'deleted'])
+
 	def __init__(self, canvas, mTaskDotNode):
 		super(GTaskDotNode, self).__init__(canvas)
 		self.__mNode = mTaskDotNode
-		mTaskDotNode.addObserver(self)
+		mTaskDotNode.addObserver(self, isDeferred=True, events=self.__mNodeEvents)
+		canvas._addGItem(self)
 		self.__isPosChanging = False
 		self.geometryChanged.connect(self.__onGeometryChanged)
 		self.setPos(*mTaskDotNode.getAttr('pos'))
@@ -510,6 +869,31 @@ class GTaskDotNode(GDotNode):
 	def delete(self):
 		self.__mNode.delete()
 
+	def _setMItem(self, mTaskDotNode):
+		"""
+		Make this node show another MTaskDotNode so that the canvas can reuse it
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		self.__mNode = mTaskDotNode
+		mTaskDotNode.addObserver(self, isDeferred=True, events=self.__mNodeEvents)
+		self.scene()._addGItem(self)
+
+		# The position is set from the model, don't send it back to the model
+		wasBlocked = self.blockSignals(True)
+		try:
+			self.setPos(*mTaskDotNode.getAttr('pos'))
+		finally:
+			self.blockSignals(wasBlocked)
+
+	def _discard(self):
+		"""
+		Remove this node from the canvas without deleting the model node
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		super(GTaskDotNode, self).delete()
+
 	# Model event callbacks.
 
 	def _onNotify(self, notifier, event, data):
@@ -523,6 +907,7 @@ class GTaskDotNode(GDotNode):
 					self.__isPosChanging = False
 
 		elif event == 'deleted':
+			self.scene()._removeGItem(self)
 			super(GTaskDotNode, self).delete()
 
 	# Qt GraphicsWidget callbacks
@@ -554,7 +939,8 @@ class GTaskConnection(GConnection):
 
 		super(GTaskConnection, self).__init__(gNodeFrom, gNodeTo)
 		self.__mNode = mConnection
-		mConnection.addObserver(self)
+		mConnection.addObserver(self, events=['deleted'])
+		canvas._addGItem(self)
 
 		self.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
 		self.destroyed.connect(self.__onDestroyed)
@@ -568,6 +954,24 @@ class GTaskConnection(GConnection):
 	def delete(self):
 		self.__mNode.delete()
 
+	def _setMItem(self, mConnection):
+		"""
+		Make this connection show another MTaskConnection between the same nodes so that the canvas can reuse it
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		self.__mNode = mConnection
+		mConnection.addObserver(self, events=['deleted'])
+		self.scene()._addGItem(self)
+
+	def _discard(self):
+		"""
+		Remove this connection from the canvas without deleting the model connection
+		"""
+		self.scene()._removeGItem(self)
+		self.__mNode.removeObserver(self)
+		super(GTaskConnection, self).delete()
+
 	@staticmethod
 	def canCanvasShowConnection(self, canvas, mConnection):
 		# Test if both ends of the connection are displayed on the canvas
@@ -577,14 +981,13 @@ class GTaskConnection(GConnection):
 
 	@staticmethod
 	def __findGNode(mNode, canvas):
-		for gNode in canvas.items():
-			if isinstance(gNode, GTaskNode) and gNode.getMItem() == mNode:
-				return gNode
+		return canvas._findGItem(mNode)
 
 	# Model event callbacks.
 
 	def _onNotify(self, notifier, event, data):
 		if event == 'deleted':
+			self.scene()._removeGItem(self)
 			super(GTaskConnection, self).delete()
 
 	# Qt event callbacks.
@@ -603,6 +1006,67 @@ if __name__ == '__main__':
 	model = MTaskModel()
 	canvas = GTaskCanvas(model)
 	canvas.show()
+
+	# Leak check: canvases opened and closed should leave nothing behind, eg. python taskView.py --leak-check
+	if '--leak-check' in sys.argv:
+		import gc
+		from utils.observable import Observable
+
+		prevNode = None
+		for i in range(10):
+			node = model.createTaskNode(model.getRoot())
+			if prevNode:
+				model.createTaskConnection(prevNode, node)
+			prevNode = node
+
+		def getObserverCount():
+			observables = [model] + list(model.getRoot().getChildren()) + list(model.getConnections())
+			return sum([len(x.getObservers()) for x in observables])
+
+		def getAliveCount(cls):
+			return len([x for x in gc.get_objects() if isinstance(x, cls)])
+
+		observerCount = getObserverCount()
+		canvasCount = getAliveCount(GTaskCanvas)
+		gNodeCount = getAliveCount(GTaskNode)
+		for i in range(100):
+			leakCanvas = GTaskCanvas(model)
+			leakCanvas.show()
+			leakCanvas._onNotify(model, 'changeRoot', None) # Show the network as if the model was loaded
+			leakCanvas.views()[0].close()
+		del leakCanvas
+
+		QtWidgets.QApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+		gc.collect()
+		assert(getObserverCount() == observerCount)
+		assert(getAliveCount(GTaskCanvas) == canvasCount)
+		assert(getAliveCount(GTaskNode) == gNodeCount)
+		print 'Leak check: ok'
+		model.clear()
+
+	# Benchmark: pass task counts to measure how long it takes to open a canvas
+	# with that many child tasks chained by connections, eg. python taskView.py 1000 10000
+	# Time per task should stay roughly the same as the count grows
+	import time
+	for taskCount in [int(x) for x in sys.argv[1:] if x.isdigit()]:
+		source = MTaskModel()
+		prevNode = None
+		for i in range(taskCount):
+			node = MTaskNode(source.getRoot(), 'task%d' % i)
+			if prevNode:
+				source.createTaskConnection(prevNode, node)
+			prevNode = node
+		dumpString = source.getDumpString()
+
+		model.clear()
+		app.processEvents()
+
+		start = time.time()
+		model.setDumpString(dumpString)
+		app.processEvents()
+		elapsed = time.time() - start
+		print 'Open canvas with %d tasks: %.3f sec (%.3f msec/task)' % (taskCount, elapsed, elapsed * 1000 / taskCount)
+
 	app.exec_()
 
 # ======================================================
@@ -1,11 +1,34 @@
-import os
+import sys
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
 import git
+from gitdb import IStream
+from git.objects.fun import tree_to_stream, tree_entries_from_data
 
 class GitStorage(object):
+	"""
+	Saves and loads versions of a file as commits of a ref that is never checked out,
+	so that saving doesn't leave the index and the working tree of the repository behind
+	"""
+
+	__refName = 'refs/timekeeper/history'
+	__legacyBranchName = 'master' # Saved to before __refName, the history continues from it
+	__blobMode = 0100644
+	__treeMode = 0040000
+
+	# Total size of the git objects load() keeps in memory for the ones loaded recently
+	__loadCacheByteBudget = 64 * 1024 * 1024
 
 	def __init__(self, repoPath, fileName='data'):
 		self.__repo = git.Repo(repoPath)
-		self.__filePath = os.path.join(repoPath, fileName)
+		self.__fileName = fileName
+		self.__loadCache = OrderedDict() # {binsha: (binaryData or dict, size)} least recently loaded first
+		self.__loadCacheSize = 0
+		self.__knownObjects = set() # binsha of the objects known to be in the object database
+		self.__saveThread = None
+		self.__saveError = None # sys.exc_info() of the last save in the background
 
 	@staticmethod
 	def isRepoReady(repoPath):
@@ -15,26 +38,156 @@ class GitStorage(object):
 		except:
 			return False
 
-	def save(self, binaryData, commitMessage):
-		self.__repo.git.checkout('master')
+	def save(self, binaryData, commitMessage, onSaved=None):
+		"""
+		Commits binaryData to the history without checking out or touching the working tree.
+		binaryData can be {name: binaryData or dict} to save a directory instead of a file,
+		objects already in the repository (eg. unchanged files of the last commit) are not written again.
+		The objects are written in the background, onSaved(log) is called from that thread when done.
+		log is (message, hexSha, date) of the commit as log() returns, or None if it failed and waitSaved()
+		raises the error then. The other methods wait for the save to finish
+		"""
+		self.waitSaved()
+		self.__saveThread = threading.Thread(target=self.__save, args=(binaryData, commitMessage, onSaved))
+		self.__saveThread.start()
+
+	def waitSaved(self):
+		"""
+		Waits for the save in the background and raises the exception it had if any
+		"""
+		if self.__saveThread:
+			self.__saveThread.join()
+			self.__saveThread = None
+
+		saveError = self.__saveError
+		if saveError:
+			self.__saveError = None
+			raise saveError[0], saveError[1], saveError[2]
+
+	def isSaving(self):
+		return bool(self.__saveThread and self.__saveThread.is_alive())
+
+	def __save(self, binaryData, commitMessage, onSaved):
+		try:
+			commit = self.__commit(binaryData, commitMessage)
+			log = (commit.message, commit.hexsha, commit.committed_date)
+		except:
+			self.__saveError = sys.exc_info()
+			log = None
+		if onSaved:
+			onSaved(log)
+
+	def __commit(self, binaryData, commitMessage):
+		repo = self.__repo
+
+		if isinstance(binaryData, dict):
+			binsha, mode = self.__storeTree(binaryData), self.__treeMode
+		else:
+			binsha, mode = self.__storeObject(git.Blob.type, binaryData), self.__blobMode
+
+		parent = self.__getHistoryCommit()
+
+		# The tree of the parent commit with the file replaced
+		entries = [(x.binsha, x.mode, x.name) for x in parent.tree] if parent else []
+		entries = [x for x in entries if x[2] != self.__fileName]
+		entries.append((binsha, mode, self.__fileName))
+		treeBinsha = self.__storeEntries(entries)
 
-		with open(self.__filePath, 'wb') as f:
-			f.write(binaryData)
+		commit = git.Commit.create_from_tree(repo, git.Tree(repo, treeBinsha), commitMessage,
+			parent_commits=[parent] if parent else [])
 
-		self.__repo.git.add('.')
-		self.__repo.git.commit(m=commitMessage)
+		# Only the ref is moved, HEAD and what it has checked out are left as they are
+		git.Reference(repo, self.__refName).set_commit(commit, logmsg='commit: %s' % commitMessage)
+		return commit
+
+	def __getHistoryRev(self):
+		# Returns the ref the history is read from, None if nothing is saved yet
+		if git.Reference(self.__repo, self.__refName).is_valid():
+			return self.__refName
+		if getattr(self.__repo.heads, self.__legacyBranchName, None):
+			return self.__legacyBranchName
+		return None
+
+	def __getHistoryCommit(self):
+		rev = self.__getHistoryRev()
+		return self.__repo.commit(rev) if rev else None
+
+	def __storeTree(self, files):
+		# Returns binsha of the tree of files {name: binaryData or dict}
+		entries = []
+		for name, data in files.iteritems():
+			if isinstance(data, dict):
+				entries.append((self.__storeTree(data), self.__treeMode, name))
+			else:
+				entries.append((self.__storeObject(git.Blob.type, data), self.__blobMode, name))
+		return self.__storeEntries(entries)
+
+	def __storeEntries(self, entries):
+		# Git sorts tree entries as if subtree names end with '/'
+		entries.sort(key=lambda x: x[2] + '/' if x[1] == self.__treeMode else x[2])
+
+		treeStream = BytesIO()
+		tree_to_stream(entries, treeStream.write)
+		return self.__storeObject(git.Tree.type, treeStream.getvalue())
+
+	def __storeObject(self, objectType, data):
+		# Returns binsha, the object is streamed into the object database unless it's there already
+		binsha = hashlib.sha1('%s %d\0%s' % (objectType, len(data), data)).digest()
+		if binsha not in self.__knownObjects:
+			self.__repo.odb.store(IStream(objectType, len(data), BytesIO(data)))
+			self.__knownObjects.add(binsha)
+		return binsha
 
 	def load(self, hexSha):
-		self.__repo.git.checkout(hexSha)
-		with open(self.__filePath, 'rb') as f:
-			return f.read()
+		"""
+		Returns the file at the commit read from the object database, without checking out.
+		It's {name: binaryData or dict} if a directory is saved, which may be shared with the other loads
+		so don't modify it. Objects are cached by SHA, so only the ones a commit changed are read
+		"""
+		self.waitSaved()
+		entry = self.__repo.commit(hexSha).tree[self.__fileName]
+		return self.__loadObject(entry.binsha)
 
-	def log(self, maxCount=-1):
+	def __loadObject(self, binsha):
+		cached = self.__loadCache.pop(binsha, None)
+		if cached is None:
+			stream = self.__repo.odb.stream(binsha)
+			data = stream.read()
+			size = len(data)
+			if stream.type == git.Tree.type:
+				data = dict((name, self.__loadObject(x)) for x, mode, name in tree_entries_from_data(data))
+			cached = (data, size)
+			self.__loadCacheSize += size
+			self.__knownObjects.add(binsha)
 
+		# The most recent last
+		self.__loadCache[binsha] = cached
+		while self.__loadCacheSize > self.__loadCacheByteBudget and len(self.__loadCache) > 1:
+			oldBinsha, (oldData, oldSize) = self.__loadCache.popitem(last=False)
+			self.__loadCacheSize -= oldSize
+
+		return cached[0]
+
+	def log(self, maxCount=-1, before=None, after=None):
+		"""
+		Returns [(message, hexSha, date)] of the history, the newest first.
+		Only the commits older than before(hexSha) and newer than after(hexSha) if they are given,
+		so that a long history can be read a page at a time
+		"""
+		self.waitSaved()
+
+		rev = before or self.__getHistoryRev()
+		if not rev:
+			return []
+		if after:
+			rev = '%s..%s' % (after, rev)
+
+		kwargs = {}
 		if maxCount > 0:
-			commits = list(self.__repo.iter_commits('master', max_count=maxCount))
-		else:
-			commits = list(self.__repo.iter_commits('master'))
+			kwargs['max_count'] = maxCount
+		if before:
+			kwargs['skip'] = 1 # before itself
+		commits = list(self.__repo.iter_commits(rev, **kwargs))
 
 		logs = []
 		for commit in commits:
@@ -44,4 +197,3 @@ class GitStorage(object):
 			logs.append((message, hexSha, date))
 
 		return logs
-
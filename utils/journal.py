@@ -0,0 +1,155 @@
+import os
+import sys
+import zlib
+import Queue
+import struct
+import threading
+import cPickle as pickle
+
+# ======================================================
+class Journal(object):
+	"""
+	Append-only file of pickled entries, written in a background thread.
+
+	Each entry is '<II' byte length and crc32 of the pickle followed by the pickle.
+	An entry cut off by a crash is detected by them, and read() ignores it and the ones after it.
+	rewrite() replaces the whole file at once, eg. with a snapshot that makes the entries so far unnecessary
+	"""
+
+	__magic = 'TKJN'
+	__entryHeader = struct.Struct('<II')
+
+	def __init__(self, filePath):
+		self.__filePath = filePath
+		self.__jobs = Queue.Queue() # (isRewrite, data), None to stop the writer
+		self.__writer = None
+		self.__writeError = None # sys.exc_info() in the writer
+
+	@staticmethod
+	def read(filePath):
+		"""
+		Returns the entries written to the file, [] if it doesn't exist
+		"""
+		try:
+			with open(filePath, 'rb') as f:
+				data = f.read()
+		except IOError:
+			return []
+
+		if data[:len(Journal.__magic)] != Journal.__magic:
+			return []
+
+		entries = []
+		pos = len(Journal.__magic)
+		headerSize = Journal.__entryHeader.size
+		while pos + headerSize <= len(data):
+			size, crc = Journal.__entryHeader.unpack_from(data, pos)
+			pos += headerSize
+			pickled = data[pos:pos + size]
+			if len(pickled) != size or zlib.crc32(pickled) & 0xffffffff != crc:
+				break # Cut off
+			entries.append(pickle.loads(pickled))
+			pos += size
+		return entries
+
+	def append(self, entry):
+		"""
+		Adds the entry to the end of the file, returns the byte size of the entry
+		"""
+		data = self.__packEntry(entry)
+		self.__addJob(False, data)
+		return len(data)
+
+	def rewrite(self, entries):
+		"""
+		Replaces the file with the entries, returns the byte size of the file
+		"""
+		data = self.__magic + ''.join([self.__packEntry(x) for x in entries])
+		self.__addJob(True, data)
+		return len(data)
+
+	def flush(self):
+		"""
+		Waits for the entries given so far to be written, raises the error the writer had if any
+		"""
+		self.__jobs.join()
+		self.__raiseWriteError()
+
+	def close(self, removesFile=False):
+		if self.__writer:
+			self.__jobs.put(None)
+			self.__writer.join()
+			self.__writer = None
+		if removesFile and os.path.exists(self.__filePath):
+			os.remove(self.__filePath)
+		self.__raiseWriteError()
+
+	def __packEntry(self, entry):
+		pickled = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+		return self.__entryHeader.pack(len(pickled), zlib.crc32(pickled) & 0xffffffff) + pickled
+
+	def __addJob(self, isRewrite, data):
+		self.__raiseWriteError()
+		if not self.__writer:
+			self.__writer = threading.Thread(target=self.__write)
+			self.__writer.daemon = True
+			self.__writer.start()
+		self.__jobs.put((isRewrite, data))
+
+	def __raiseWriteError(self):
+		writeError = self.__writeError
+		if writeError:
+			self.__writeError = None
+			raise writeError[0], writeError[1], writeError[2]
+
+	def __write(self):
+		f = None
+		try:
+			while True:
+				# Jobs piled up while writing are written together and synced once
+				jobs = [self.__jobs.get()]
+				while not self.__jobs.empty():
+					jobs.append(self.__jobs.get())
+
+				try:
+					if not self.__writeError:
+						f = self.__writeJobs(f, [x for x in jobs if x])
+				except:
+					self.__writeError = sys.exc_info()
+				finally:
+					for job in jobs:
+						self.__jobs.task_done()
+
+				if None in jobs:
+					return
+		finally:
+			if f:
+				f.close()
+
+	def __writeJobs(self, f, jobs):
+		# Returns the file opened to append to
+		for isRewrite, data in jobs:
+			if isRewrite:
+				if f:
+					f.close()
+					f = None
+				tempPath = self.__filePath + '.tmp'
+				with open(tempPath, 'wb') as tempFile:
+					tempFile.write(data)
+					tempFile.flush()
+					os.fsync(tempFile.fileno())
+				if os.name == 'nt' and os.path.exists(self.__filePath):
+					os.remove(self.__filePath) # Can't rename over a file
+				os.rename(tempPath, self.__filePath)
+			else:
+				if not f:
+					f = open(self.__filePath, 'ab')
+					f.seek(0, os.SEEK_END)
+					if not f.tell():
+						f.write(self.__magic)
+				f.write(data)
+
+		if f:
+			f.flush()
+			os.fsync(f.fileno())
+		return f
@@ -69,6 +69,44 @@ class DynamicMergeableDict(dict):
 
 		return dSelfResult
 
+# ======================================================
+class FrozenMergedDict(dict):
+	"""
+	Read only dict of the given dicts merged in order the same way as MergeableDict.merge().
+	The merge is resolved when it's created, so reading is a plain dict lookup unlike DynamicMergeableDict.
+	Keyword arguments are merged last. Nested dicts are merged and frozen too,
+	create another one to change the values eg.
+
+		config = FrozenMergedDict(config, size=3)
+	"""
+
+	def __init__(self, *dicts, **kargs):
+		merged = {}
+		for d in dicts + (kargs,):
+			assert(isinstance(d, dict))
+			FrozenMergedDict.__merge(merged, d)
+		super(FrozenMergedDict, self).__init__(merged)
+
+	@staticmethod
+	def __merge(this, other):
+		# The given dicts are left unchanged, the dicts created while merging are frozen afterwards
+		for key, ovalue in other.items():
+			svalue = this.get(key)
+			if isinstance(ovalue, dict):
+				if isinstance(svalue, dict):
+					ovalue = FrozenMergedDict(svalue, ovalue)
+				elif not isinstance(ovalue, FrozenMergedDict):
+					ovalue = FrozenMergedDict(ovalue)
+			this[key] = ovalue
+
+	def __readOnly(self, *args, **kargs):
+		raise TypeError('FrozenMergedDict is read only')
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readOnly
+
+	def __reduce__(self):
+		return (FrozenMergedDict, (dict(self),))
+
 if __name__ == '__main__':
 	base = {1:1, 2:2, 3:{31:31, 32:32, 33:{331:331, 332:332}}}
 	over = {2:-2, 4:-4, 3:{32:-32, 34:-34, 33:{332:-332, 334:-334}}}
@@ -91,3 +129,8 @@ if __name__ == '__main__':
 	assert[b[3][33][331] == 331]
 	assert[b[3][33][332] == -332]
 	assert[b[3][33][334] == -334]
+
+	c = FrozenMergedDict(base, over)
+	assert(c == expected)
+	assert(over[3][33] == {332:-332, 334:-334})
+	assert(isinstance(c[3][33], FrozenMergedDict))
@@ -1,26 +1,191 @@
+import weakref
+import itertools
+
 # ======================================================
 class Observable(object):
+	"""
+	Observers are referred to weakly, an observer no longer referred to from anywhere else stops observing.
+	Such observers are skipped, and dropped when the table below is rebuilt.
+
+	Observers can subscribe to some of the events only (see addObserver()), so that they are not called
+	for the others. Which observers an event goes to is looked up in a table built on demand.
+
+	Deferred observers (see addObserver()) get events with a key (see _getEventKey()) notified between
+	beginNotifyBatch() and endNotifyBatch() when the batch ends, so that a series of changes (eg. paste, drag)
+	updates them once. Events of the same name and key are merged into one while batched.
+	Events without a key (eg. deletion) are notified at once as they may change what observers observe
+	"""
+
+	# Outermost _notify() calls are numbered so that observers can tell events caused by the same change
+	__notifySerial = 0
+	__notifyDepth = 0
+	__notifyOrigin = None # (notifier, event, data) of the outermost event being notified
+
+	__notifyBatchDepth = 0
+	__batchedEvents = [] # [[notifier, event, data]] in the order they are notified
+	__batchedEventIndices = {} # {(notifier, event, eventKey): index in __batchedEvents}
+
+	__subscriptionCounter = itertools.count() # Observers are notified in the order they are added
 
 	def __init__(self):
-		self.__observers = []
+		self.__observers = {} # {weakref of observer: (subscription order, isDeferred, frozenset(events) or None)}
+		self.__dispatchTable = {} # {(event, eventKey): ([observer weakref], [deferred observer weakref])}
 
-	def addObserver(self, observer):
-		if observer not in self.__observers:
-			self.__observers.append(observer)
+	def addObserver(self, observer, isDeferred=False, events=None):
+		"""
+		Events are deferred while batched if isDeferred is True.
+		It suits observers that only reflect the state (eg. views), not ones the model relies on.
+
+		events limits the events notified to the observer, all the events if None. Each one is an event name
+		or (event name, event key) to limit it to the key (eg. ('attrChanged', 'pos'), see _getEventKey())
+		"""
+		observerRef = weakref.ref(observer) # Without a callback, so that it is shared by the observables
+		subscription = self.__observers.get(observerRef)
+		order = subscription[0] if subscription else next(Observable.__subscriptionCounter)
+		self.__observers[observerRef] = (order, isDeferred, None if events is None else frozenset(events))
+		self.__dispatchTable.clear()
 
 	def removeObserver(self, observer):
-		if observer in self.__observers:
-			self.__observers.remove(observer)
+		if self.__observers.pop(weakref.ref(observer), None):
+			self.__dispatchTable.clear()
+
+	def hasObserver(self, observer):
+		return weakref.ref(observer) in self.__observers
 
 	def clearObservers(self):
-			self.__observers = []
+		self.__observers = {}
+		self.__dispatchTable = {}
 
 	def getObservers(self):
-		return self.__observers
+		return [x[0] for x in self.__getSubscriptions()]
+
+	def __getSubscriptions(self):
+		# Returns [(observer, isDeferred, events)] of the live observers in the order they are added
+		subscriptions = sorted(self.__observers.items(), key=lambda x: x[1][0])
+		subscriptions = [(ref(), isDeferred, events) for ref, (order, isDeferred, events) in subscriptions]
+		return [x for x in subscriptions if x[0] is not None]
+
+	@staticmethod
+	def getNotifySerial():
+		"""
+		Returns the serial number of the outermost event being notified, or None if not notifying.
+		Events notified in observers' _onNotify() share the serial number with the event that caused them
+		"""
+		if not Observable.__notifyDepth:
+			return None
+		return Observable.__notifySerial
+
+	@staticmethod
+	def getNotifyOrigin():
+		"""
+		Returns (notifier, event, data) of the outermost event being notified, or None if not notifying.
+		It tells the change that caused the events notified in observers' _onNotify()
+		"""
+		return Observable.__notifyOrigin
+
+	@staticmethod
+	def beginNotifyBatch():
+		"""
+		Events for deferred observers are queued until the matching endNotifyBatch() call. Can be nested
+		"""
+		Observable.__notifyBatchDepth += 1
+
+	@staticmethod
+	def endNotifyBatch():
+		assert(Observable.__notifyBatchDepth > 0)
+		Observable.__notifyBatchDepth -= 1
+		if Observable.__notifyBatchDepth:
+			return
+
+		# Events notified while delivering these are not batched
+		batchedEvents = Observable.__batchedEvents
+		Observable.__batchedEvents = []
+		Observable.__batchedEventIndices = {}
+		for notifier, event, data in batchedEvents:
+			observers, deferredObservers = notifier.__getSubscribers(event, notifier._getEventKey(event, data))
+			if deferredObservers:
+				notifier.__deliver(deferredObservers, event, data)
 
 	def _notify(self, event, data=None):
-		for observer in self.__observers:
-			observer._onNotify(self, event, data)
+		eventKey = self._getEventKey(event, data)
+		observers, deferredObservers = self.__getSubscribers(event, eventKey)
+		if not deferredObservers:
+			if observers:
+				self.__deliver(observers, event, data)
+		elif not Observable.__notifyBatchDepth or eventKey is None:
+			self.__deliver(observers + deferredObservers, event, data)
+		else:
+			self.__deliver(observers, event, data)
+			self.__queue(event, eventKey, data)
+
+	def __getSubscribers(self, event, eventKey):
+		subscribers = self.__dispatchTable.get((event, eventKey))
+		if subscribers is None:
+			observers = []
+			deferredObservers = []
+			for observerRef, (order, isDeferred, events) in sorted(self.__observers.items(), key=lambda x: x[1][0]):
+				if observerRef() is None:
+					del self.__observers[observerRef]
+				elif events is None or event in events or (event, eventKey) in events:
+					(deferredObservers if isDeferred else observers).append(observerRef)
+			subscribers = self.__dispatchTable[(event, eventKey)] = (observers, deferredObservers)
+		return subscribers
+
+	def __deliver(self, observerRefs, event, data):
+		if not Observable.__notifyDepth:
+			Observable.__notifySerial += 1
+			Observable.__notifyOrigin = (self, event, data)
+		Observable.__notifyDepth += 1
+		try:
+			for observerRef in observerRefs:
+				observer = observerRef()
+				if observer is not None:
+					observer._onNotify(self, event, data)
+		finally:
+			Observable.__notifyDepth -= 1
+			if not Observable.__notifyDepth:
+				Observable.__notifyOrigin = None
+
+	def __queue(self, event, eventKey, data):
+		key = (self, event, eventKey)
+		index = Observable.__batchedEventIndices.get(key)
+		if index is not None:
+			batchedEvent = Observable.__batchedEvents[index]
+			batchedEvent[2] = self._mergeEventData(event, batchedEvent[2], data)
+			return
+		Observable.__batchedEventIndices[key] = len(Observable.__batchedEvents)
+		Observable.__batchedEvents.append([self, event, data])
+
+	def _getEventKey(self, event, data):
+		"""
+		Override this to tell events of the same name apart (eg. by the attribute changed).
+		Observers can subscribe to the events of a key, and batched events of the same key are merged
+		"""
+		return None
+
+	def _mergeEventData(self, event, data, newData):
+		"""
+		Override this to merge the data of a batched event with the data of the same event notified later
+		"""
+		return newData
 
 	def _onNotify(self, notifier, event, data):
 		pass
+
+	def __getstate__(self):
+		# Weak references can't be pickled, observers are pickled as [(observer, isDeferred, events)]
+		d = self.__dict__.copy()
+		d['_Observable__observers'] = self.__getSubscriptions()
+		d['_Observable__dispatchTable'] = {}
+		return d
+
+	def __setstate__(self, d):
+		subscriptions = d['_Observable__observers']
+		self.__dict__ = d
+		self.__observers = {}
+		self.__dispatchTable = {}
+		for subscription in subscriptions:
+			if isinstance(subscription, tuple):
+				self.addObserver(*subscription)
+			else:
+				self.addObserver(subscription) # Files saved before subscriptions are supported
@@ -0,0 +1,729 @@
+import gc
+import struct
+import functools
+import cPickle as pickle
+
+# ======================================================
+# Compact binary format of a TreeNode tree and edges between the nodes
+"""
+All integers are little endian.
+
+	header			'<4sHH'	magic, version, reserved
+	string table	'<I' count, '<I' * (count + 1) byte offsets of the strings, then utf-8 bytes of all the strings
+	class table		'<I' count, '<I' * count string indices of class names
+	node table		'<I' count, '<I' * count class indices, '<i' * count parent node indices (-1 for the root),
+					'<I' * count subtree sizes (number of the nodes in the subtree including the node)
+	attr columns	'<I' count, then for each column;
+						'<IBI' attr name string index, value type, number of values
+						'<I' * node count value indices of the nodes (MISSING if a node doesn't have the attribute),
+							only if some nodes don't have the attribute
+						values, see _ValueType
+	edge table		'<I' count, '<I' * count parent node indices of the from nodes in ascending order,
+					'<I' * count from node indices, '<I' * count to node indices
+
+Nodes are stored in pre-order so a parent always precedes its children and children keep their order.
+Values of an attribute are stored together as a typed array (a column) instead of per node.
+An attribute has a column per kind of its values (see _getColumnKind()) so that ints and floats
+come back as they were, the columns of an attribute never have a value for the same node.
+Everything but pickled columns has a fixed size per element, so a node can be read
+without reading the others (see LazyTree).
+"""
+
+MAGIC = 'TKTF'
+VERSION = 2
+MISSING = 0xffffffff
+
+class _ValueType(object):
+	INT = 0 # '<q' per value
+	FLOAT = 1 # '<d' per value
+	STRING = 2 # '<I' string index per value
+	FLOAT_PAIR = 3 # '<dd' per value, tuple of 2 floats
+	PICKLE = 4 # '<I' byte length and a pickled list of the values, for anything else
+	INT_PAIR = 5 # '<qq' per value, tuple of 2 ints
+
+_valueStructs = {
+	_ValueType.INT: struct.Struct('<q'),
+	_ValueType.FLOAT: struct.Struct('<d'),
+	_ValueType.STRING: struct.Struct('<I'),
+	_ValueType.FLOAT_PAIR: struct.Struct('<dd'),
+	_ValueType.INT_PAIR: struct.Struct('<qq'),
+}
+_pairValueTypes = (_ValueType.FLOAT_PAIR, _ValueType.INT_PAIR)
+_uint32 = struct.Struct('<I')
+
+# ------------------------------------------------------
+def isTreeFile(data):
+	return data[:len(MAGIC)] == MAGIC
+
+# ------------------------------------------------------
+def dumps(root, edges):
+	"""
+	Returns the tree rooted at root and edges [(fromNode, toNode)] in the binary format.
+	Both nodes of an edge must be in the tree
+	"""
+	strings = _StringTable()
+
+	# Nodes in pre-order
+	nodes = []
+	parentIndices = []
+	nodeToIndex = {}
+	stack = [(root, -1)]
+	while stack:
+		node, parentIndex = stack.pop()
+		nodeToIndex[node] = len(nodes)
+		nodes.append(node)
+		parentIndices.append(parentIndex)
+		index = nodeToIndex[node]
+		stack.extend((x, index) for x in reversed(node.getChildren()))
+
+	count = len(nodes)
+	subtreeSizes = [1] * count
+	for index in xrange(count - 1, 0, -1):
+		subtreeSizes[parentIndices[index]] += subtreeSizes[index]
+
+	classNameToIndex = {}
+	classIndices = []
+	for node in nodes:
+		classIndices.append(classNameToIndex.setdefault(node.__class__.__name__, len(classNameToIndex)))
+	classNames = sorted(classNameToIndex, key=classNameToIndex.get)
+
+	# Attributes by column
+	columns = {} # {(attrName, columnKind): ([nodeIndex], [value])}
+	for index, node in enumerate(nodes):
+		for name, value in node.getAttrs().items():
+			column = columns.setdefault((name, _getColumnKind(value)), ([], []))
+			column[0].append(index)
+			column[1].append(value)
+
+	chunks = []
+	chunks.append(_packArray('I', [strings.add(x) for x in classNames]))
+	chunks.append(_packArray('I', classIndices))
+	chunks.append(struct.pack('<%di' % count, *parentIndices))
+	chunks.append(struct.pack('<%dI' % count, *subtreeSizes))
+
+	chunks.append(struct.pack('<I', len(columns)))
+	for (name, kind), (indices, values) in sorted(columns.items()):
+		valueType, packedValues = _packValues(values, strings)
+		chunks.append(struct.pack('<IBI', strings.add(name), valueType, len(indices)))
+		if len(indices) != count:
+			valueIndices = [MISSING] * count
+			for valueIndex, index in enumerate(indices):
+				valueIndices[index] = valueIndex
+			chunks.append(struct.pack('<%dI' % count, *valueIndices))
+		chunks.append(packedValues)
+
+	indexEdges = [(nodeToIndex[x], nodeToIndex[y]) for x, y in edges]
+	indexEdges.sort(key=lambda x: parentIndices[x[0]])
+	chunks.append(_packArray('I', [parentIndices[x[0]] for x in indexEdges]))
+	chunks.append(struct.pack('<%dI' % len(indexEdges), *[x[0] for x in indexEdges]))
+	chunks.append(struct.pack('<%dI' % len(indexEdges), *[x[1] for x in indexEdges]))
+
+	header = struct.pack('<4sHH', MAGIC, VERSION, 0)
+	return ''.join([header, strings.pack()] + chunks)
+
+# ------------------------------------------------------
+def loads(data, nodeClasses):
+	"""
+	Returns (root, [(fromNode, toNode)]) from the data created with dumps().
+	nodeClasses is {className: class} of the nodes in the data. Nodes are created with
+	class._createLoaded(attrs, parent) without emitting any event
+	"""
+	# Creating a lot of objects at once runs the cyclic garbage collector over and over
+	# though none of them is garbage
+	isGcEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		return _loads(_Reader(data), nodeClasses)
+	finally:
+		if isGcEnabled:
+			gc.enable()
+
+def _loads(reader, nodeClasses):
+	_readHeader(reader)
+
+	strings = _StringTable.unpack(reader)
+
+	classes = [nodeClasses[strings[x]] for x in reader.unpackArray('I')]
+	classIndices = reader.unpackArray('I')
+	count = len(classIndices)
+	parentIndices = reader.unpack('<%di' % count)
+	reader.skip(4 * count) # Subtree sizes
+
+	# Columns that every node has are zipped into the attribute dicts at once
+	fullNames = []
+	fullValues = []
+	partialColumns = []
+	columnCount = reader.unpack('<I')[0]
+	for i in xrange(columnCount):
+		nameIndex, valueType, valueCount = reader.unpack('<IBI')
+		name = strings[nameIndex]
+		if valueCount != count:
+			valueIndices = reader.unpack('<%dI' % count)
+			indices = [x for x in xrange(count) if valueIndices[x] != MISSING]
+		values = _unpackValues(reader, valueType, valueCount, strings)
+		if valueCount == count:
+			fullNames.append(name)
+			fullValues.append(values)
+		else:
+			partialColumns.append((name, indices, values))
+
+	if fullNames:
+		attrs = [dict(zip(fullNames, x)) for x in zip(*fullValues)]
+	else:
+		attrs = [{} for x in xrange(count)]
+	for name, indices, values in partialColumns:
+		for index, value in zip(indices, values):
+			attrs[index][name] = value
+
+	nodes = []
+	for i in xrange(count):
+		parentIndex = parentIndices[i]
+		parent = nodes[parentIndex] if parentIndex >= 0 else None
+		nodes.append(classes[classIndices[i]]._createLoaded(attrs[i], parent))
+
+	edgeCount = reader.unpack('<I')[0]
+	reader.skip(4 * edgeCount) # Parent node indices
+	fromIndices = reader.unpack('<%dI' % edgeCount)
+	toIndices = reader.unpack('<%dI' % edgeCount)
+	edges = [(nodes[x], nodes[y]) for x, y in zip(fromIndices, toIndices)]
+
+	return nodes[0], edges
+
+def _readHeader(reader):
+	magic, version, reserved = reader.unpack('<4sHH')
+	if magic != MAGIC:
+		raise ValueError('Not a tree file')
+	if version != VERSION:
+		raise ValueError('Unsupported tree file version %d' % version)
+
+# ------------------------------------------------------
+class LazyTree(object):
+	"""
+	Creates the nodes in the data created with dumps() as they are accessed.
+	Only the root is created at first, and the children of a node are created when they are accessed
+	for the first time (see TreeNode._setChildrenLoader()). Each node is read directly from the data
+	which is not copied, so the data can be a memory mapped file of any size.
+
+	nodeClasses is the same as loads().
+	onEdgesLoaded(parent, [(fromNode, toNode)]) is called with the edges between the children of
+	the parent when they are created
+	"""
+
+	def __init__(self, data, nodeClasses, onEdgesLoaded):
+		self.__data = data
+		self.__onEdgesLoaded = onEdgesLoaded
+
+		reader = _Reader(data)
+		_readHeader(reader)
+
+		# Only the positions of the arrays are read so that it doesn't depend on the number of nodes
+		stringCount = reader.unpack('<I')[0]
+		self.__stringOffsetsPos = reader.tell()
+		reader.skip(4 * stringCount)
+		stringDataSize = reader.unpack('<I')[0]
+		self.__stringDataPos = reader.tell()
+		reader.skip(stringDataSize)
+		self.__strings = {} # {stringIndex: string}
+
+		self.__classes = [nodeClasses[self.__getString(x)] for x in reader.unpackArray('I')]
+
+		self.__nodeCount = reader.unpack('<I')[0]
+		self.__classIndicesPos = reader.tell()
+		reader.skip(4 * self.__nodeCount * 2) # Class and parent node indices
+		self.__subtreeSizesPos = reader.tell()
+		reader.skip(4 * self.__nodeCount)
+
+		# [(name, valueType, valueIndicesPos, valuesPos)], valueIndicesPos is None if every node has the attribute
+		self.__columns = []
+		self.__pickledColumns = {} # {columnIndex: [value]} unpickled when they are needed
+		columnCount = reader.unpack('<I')[0]
+		for i in xrange(columnCount):
+			nameIndex, valueType, valueCount = reader.unpack('<IBI')
+			valueIndicesPos = None
+			if valueCount != self.__nodeCount:
+				valueIndicesPos = reader.tell()
+				reader.skip(4 * self.__nodeCount)
+			valuesPos = reader.tell()
+			if valueType == _ValueType.PICKLE:
+				reader.skip(reader.unpack('<I')[0])
+			elif valueType in _valueStructs:
+				reader.skip(_valueStructs[valueType].size * valueCount)
+			else:
+				raise ValueError('Unknown value type %d' % valueType)
+			self.__columns.append((self.__getString(nameIndex), valueType, valueIndicesPos, valuesPos))
+
+		self.__edgeCount = reader.unpack('<I')[0]
+		self.__edgeParentsPos = reader.tell()
+		self.__edgeFromsPos = self.__edgeParentsPos + 4 * self.__edgeCount
+		self.__edgeTosPos = self.__edgeFromsPos + 4 * self.__edgeCount
+
+	def createRoot(self):
+		return self.__createNode(0, None)
+
+	def __createNode(self, index, parent):
+		data = self.__data
+		attrs = {}
+		for columnIndex, (name, valueType, valueIndicesPos, valuesPos) in enumerate(self.__columns):
+			valueIndex = index
+			if valueIndicesPos is not None:
+				valueIndex = _uint32.unpack_from(data, valueIndicesPos + 4 * index)[0]
+				if valueIndex == MISSING:
+					continue
+
+			valueStruct = _valueStructs.get(valueType)
+			if not valueStruct:
+				attrs[name] = self.__getPickledValue(columnIndex, valueIndex)
+				continue
+			value = valueStruct.unpack_from(data, valuesPos + valueStruct.size * valueIndex)
+			if valueType == _ValueType.STRING:
+				value = self.__getString(value[0])
+			elif valueType not in _pairValueTypes:
+				value = value[0]
+			attrs[name] = value
+
+		nodeClass = self.__classes[_uint32.unpack_from(data, self.__classIndicesPos + 4 * index)[0]]
+		node = nodeClass._createLoaded(attrs, parent)
+		if self.__getSubtreeSize(index) > 1:
+			node._setChildrenLoader(functools.partial(self.__loadChildren, index))
+		return node
+
+	def __loadChildren(self, index, node):
+		indexToChild = {}
+		childIndex = index + 1
+		end = index + self.__getSubtreeSize(index)
+		while childIndex < end:
+			indexToChild[childIndex] = self.__createNode(childIndex, node)
+			childIndex += self.__getSubtreeSize(childIndex)
+
+		first = self.__bisect(self.__edgeParentsPos, self.__edgeCount, index)
+		last = self.__bisect(self.__edgeParentsPos, self.__edgeCount, index + 1)
+		edges = []
+		for edgeIndex in xrange(first, last):
+			fromIndex = _uint32.unpack_from(self.__data, self.__edgeFromsPos + 4 * edgeIndex)[0]
+			toIndex = _uint32.unpack_from(self.__data, self.__edgeTosPos + 4 * edgeIndex)[0]
+			edges.append((indexToChild[fromIndex], indexToChild[toIndex]))
+		if edges:
+			self.__onEdgesLoaded(node, edges)
+
+	def __getSubtreeSize(self, index):
+		return _uint32.unpack_from(self.__data, self.__subtreeSizesPos + 4 * index)[0]
+
+	def __getPickledValue(self, columnIndex, valueIndex):
+		values = self.__pickledColumns.get(columnIndex)
+		if values is None:
+			valuesPos = self.__columns[columnIndex][3]
+			size = _uint32.unpack_from(self.__data, valuesPos)[0]
+			values = pickle.loads(self.__data[valuesPos + 4:valuesPos + 4 + size])
+			self.__pickledColumns[columnIndex] = values
+		return values[valueIndex]
+
+	def __getString(self, stringIndex):
+		string = self.__strings.get(stringIndex)
+		if string is None:
+			start, end = struct.unpack_from('<II', self.__data, self.__stringOffsetsPos + 4 * stringIndex)
+			string = _decodeString(self.__data[self.__stringDataPos + start:self.__stringDataPos + end])
+			self.__strings[stringIndex] = string
+		return string
+
+	def __bisect(self, arrayPos, count, value):
+		# Returns the first index of the '<I' array whose value is not less than the value
+		low, high = 0, count
+		while low < high:
+			middle = (low + high) // 2
+			if _uint32.unpack_from(self.__data, arrayPos + 4 * middle)[0] < value:
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+# ------------------------------------------------------
+def dumpRecords(root, edges):
+	"""
+	Returns the tree rooted at root and edges [(fromNode, toNode)] as records, nested dicts of strings
+	to be stored by content (eg. as a git tree, see GitStorage) so that versions share unchanged nodes.
+
+	Each node is a dict of its own;
+		'node'		pickled (class name, [(attrName, value)] sorted by the name)
+		'c12'		{'5': records of the child} for the child at 12 * _recordFanout + 5, children are
+					grouped so that a change rewrites only a group and the list of the groups
+		'edges'		pickled [(from child index, (levels up, (child index, ...)))] edges from the children,
+					the to node is relative to this node. Only if there are edges
+	"""
+	edgesByParent = {} # {parent: [(fromNode, toNode)]}
+	for edge in edges:
+		edgesByParent.setdefault(edge[0].getParent(), []).append(edge)
+	return _dumpSubtreeRecords(root, (), lambda x: edgesByParent.get(x))
+
+def dumpRecordsDelta(oldSnapshot, newSnapshot, getEdges, edgeChangedParents=()):
+	"""
+	Returns the changes from oldSnapshot to newSnapshot, TreeNodeSnapshots of the same root,
+	as a list of operations that applyRecordsDelta() applies to the records of oldSnapshot.
+	Only the changed subtrees are visited so it's cheap if the snapshots share most of the tree.
+
+	The tree must be as newSnapshot. getEdges(parent) returns [(fromNode, toNode)] from the children of
+	the parent, the edges are updated for edgeChangedParents and the parents whose children have changed
+	"""
+	delta = []
+	childrenChangedParents = []
+	stack = [(oldSnapshot, newSnapshot, ())]
+	while stack:
+		old, new, path = stack.pop()
+		if old is new:
+			continue
+		if old is None or old.node is not new.node:
+			delta.append(('tree', path, _dumpSubtreeRecords(new.node, path, getEdges)))
+			continue
+
+		if old.attrs != new.attrs:
+			delta.append(('node', path, _dumpNodeRecord(new.node, new.attrs)))
+
+		# Children None means the children as loaded (see TreeNode.getLoadedChildSnapshots()),
+		# so a lazily loaded tree is not loaded to tell the changes
+		oldChildren = old.children
+		if oldChildren is None:
+			oldChildren = new.node.getLoadedChildSnapshots()
+		newChildren = new.children
+		if newChildren is None:
+			newChildren = new.node.getLoadedChildSnapshots()
+
+		keptChildren = oldChildren
+		newChildNodes = [x.node for x in newChildren]
+		if [x.node for x in oldChildren] != newChildNodes:
+			childrenChangedParents.append(new.node)
+
+			# Removed children first, the others are compared with the children at the same index after that
+			newChildNodeSet = set(newChildNodes)
+			keptChildren = [x for x in oldChildren if x.node in newChildNodeSet]
+			for index in xrange(len(oldChildren) - 1, -1, -1):
+				if oldChildren[index].node not in newChildNodeSet:
+					delta.append(('remove', path + (index,)))
+			if len(keptChildren) > len(newChildren):
+				delta.append(('truncate', path, len(newChildren)))
+
+		for index, child in enumerate(newChildren):
+			oldChild = keptChildren[index] if index < len(keptChildren) else None
+			stack.append((oldChild, child, path + (index,)))
+
+	root = newSnapshot.node
+	for parent in set(edgeChangedParents) | set(childrenChangedParents):
+		path = _getPath(parent, root)
+		if path is not None:
+			edges = getEdges(parent)
+			delta.append(('edges', path, _dumpEdgesRecord(path, edges, {}, root) if edges else None))
+
+	return delta
+
+def applyRecordsDelta(records, delta):
+	"""
+	Applies the result of dumpRecordsDelta() to the records in place
+	"""
+	for operation in delta:
+		kind, path = operation[:2]
+		if kind == 'node':
+			_getRecordsAt(records, path)['node'] = operation[2]
+		elif kind == 'edges':
+			nodeRecords = _getRecordsAt(records, path)
+			if operation[2]:
+				nodeRecords['edges'] = operation[2]
+			else:
+				nodeRecords.pop('edges', None)
+		elif kind == 'tree':
+			if path:
+				_setChildRecords(_getRecordsAt(records, path[:-1]), path[-1], operation[2])
+			else:
+				records.clear()
+				records.update(operation[2])
+		elif kind == 'remove':
+			parentRecords = _getRecordsAt(records, path[:-1])
+			count = _getChildCount(parentRecords)
+			for index in xrange(path[-1], count - 1):
+				_setChildRecords(parentRecords, index, _getChildRecords(parentRecords, index + 1))
+			_deleteChildRecords(parentRecords, count - 1)
+		elif kind == 'truncate':
+			parentRecords = _getRecordsAt(records, path)
+			for index in xrange(_getChildCount(parentRecords) - 1, operation[2] - 1, -1):
+				_deleteChildRecords(parentRecords, index)
+		else:
+			raise ValueError('Unknown operation %s' % kind)
+
+def copyRecords(records):
+	"""
+	Returns a copy of the records to be modified with applyRecordsDelta(),
+	eg. records loaded from GitStorage that share a dict between the same subtrees
+	"""
+	copy = {}
+	stack = [(records, copy)]
+	while stack:
+		source, target = stack.pop()
+		for name, value in source.iteritems():
+			if isinstance(value, dict):
+				target[name] = {}
+				stack.append((value, target[name]))
+			else:
+				target[name] = value
+	return copy
+
+def loadRecords(records, nodeClasses):
+	"""
+	Returns (root, [(fromNode, toNode)]) from the records created with dumpRecords().
+	nodeClasses is the same as loads()
+	"""
+	return createDecodedNodes(decodeRecords(records), nodeClasses)
+
+def decodeRecords(records):
+	"""
+	First half of loadRecords(), returns ([(className, attrs, parentIndex)] in pre-order, [(fromIndex, toIndex)]).
+	Only plain values are created, so it can be called from another thread
+	"""
+	nodes = []
+	pathToIndex = {}
+	edgeRecords = [] # [(parent path, pickled edges)]
+	stack = [(records, -1, ())]
+	while stack:
+		nodeRecords, parentIndex, path = stack.pop()
+		className, nodeAttrs = pickle.loads(nodeRecords['node'])
+		index = pathToIndex[path] = len(nodes)
+		nodes.append((className, dict(nodeAttrs), parentIndex))
+		if 'edges' in nodeRecords:
+			edgeRecords.append((path, nodeRecords['edges']))
+
+		children = [] # [(childIndex, records)]
+		for group, groupRecords in nodeRecords.iteritems():
+			if group.startswith('c'):
+				groupStart = int(group[1:]) * _recordFanout
+				children.extend((groupStart + int(x), y) for x, y in groupRecords.iteritems())
+		# Reversed so that children are visited in order
+		children.sort(reverse=True)
+		stack.extend((x[1], index, path + (x[0],)) for x in children)
+
+	edges = []
+	for parentPath, pickledEdges in edgeRecords:
+		for fromIndex, (levelsUp, toSubPath) in pickle.loads(pickledEdges):
+			toPath = parentPath[:len(parentPath) - levelsUp] + toSubPath
+			edges.append((pathToIndex[parentPath + (fromIndex,)], pathToIndex[toPath]))
+
+	return nodes, edges
+
+def createDecodedNodes(decodedRecords, nodeClasses):
+	"""
+	Second half of loadRecords(), creates the nodes of the result of decodeRecords().
+	The attribute dicts are given to the nodes, so the result can be used only once
+	"""
+	decodedNodes, decodedEdges = decodedRecords
+
+	# Same as loads()
+	isGcEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		nodes = []
+		for className, attrs, parentIndex in decodedNodes:
+			parent = nodes[parentIndex] if parentIndex >= 0 else None
+			nodes.append(nodeClasses[className]._createLoaded(attrs, parent))
+		return nodes[0], [(nodes[x], nodes[y]) for x, y in decodedEdges]
+	finally:
+		if isGcEnabled:
+			gc.enable()
+
+_recordFanout = 32
+
+def _getRecordNames(childIndex):
+	# Returns (group name, name in the group)
+	return 'c%d' % (childIndex // _recordFanout), str(childIndex % _recordFanout)
+
+def _dumpSubtreeRecords(subtreeRoot, rootPath, getEdges):
+	# Returns the records of the subtree at rootPath
+	pathToRecords = {} # {(childIndex, ...): records}
+	nodeToPath = {}
+	stack = [(subtreeRoot, rootPath)]
+	while stack:
+		node, path = stack.pop()
+		records = {'node': _dumpNodeRecord(node, node.getAttrs())}
+		if path != rootPath:
+			_setChildRecords(pathToRecords[path[:-1]], path[-1], records)
+		pathToRecords[path] = records
+		nodeToPath[node] = path
+		stack.extend((x, path + (i,)) for i, x in enumerate(node.getChildren()))
+
+	root = subtreeRoot
+	for i in rootPath:
+		root = root.getParent()
+	for node, path in nodeToPath.iteritems():
+		edges = getEdges(node)
+		if edges:
+			pathToRecords[path]['edges'] = _dumpEdgesRecord(path, edges, nodeToPath, root)
+
+	return pathToRecords[rootPath]
+
+def _dumpNodeRecord(node, nodeAttrs):
+	return pickle.dumps((node.__class__.__name__, sorted(nodeAttrs.items())), pickle.HIGHEST_PROTOCOL)
+
+def _dumpEdgesRecord(parentPath, edges, nodeToPath, root):
+	# nodeToPath is {node: path} of the nodes known, the others are looked up under the root
+	packedEdges = []
+	for fromNode, toNode in edges:
+		fromPath = nodeToPath[fromNode] if fromNode in nodeToPath else _getPath(fromNode, root)
+		toPath = nodeToPath[toNode] if toNode in nodeToPath else _getPath(toNode, root)
+		common = 0
+		while common < len(parentPath) and common < len(toPath) and parentPath[common] == toPath[common]:
+			common += 1
+		packedEdges.append((fromPath[-1], (len(parentPath) - common, toPath[common:])))
+	return pickle.dumps(sorted(packedEdges), pickle.HIGHEST_PROTOCOL)
+
+def _getPath(node, root):
+	# Returns (childIndex, ...) of the node under the root, None if it's not under the root
+	path = []
+	while node is not root:
+		parent = node.getParent() if node else None
+		if parent is None:
+			return None
+		path.append(parent.getChildren().index(node))
+		node = parent
+	return tuple(reversed(path))
+
+def _getRecordsAt(records, path):
+	for index in path:
+		records = _getChildRecords(records, index)
+	return records
+
+def _getChildRecords(records, index):
+	group, name = _getRecordNames(index)
+	return records[group][name]
+
+def _setChildRecords(records, index, childRecords):
+	group, name = _getRecordNames(index)
+	records.setdefault(group, {})[name] = childRecords
+
+def _deleteChildRecords(records, index):
+	group, name = _getRecordNames(index)
+	del records[group][name]
+	if not records[group]:
+		del records[group]
+
+def _getChildCount(records):
+	return sum(len(y) for x, y in records.iteritems() if x.startswith('c'))
+
+# ------------------------------------------------------
+def _packArray(typeCode, values):
+	return struct.pack('<I%d%s' % (len(values), typeCode), len(values), *values)
+
+_numberKinds = {int: 'i', long: 'i', float: 'f'}
+
+def _getColumnKind(value):
+	# Values of an attribute are split into columns by this, so a column never mixes ints and floats
+	if type(value) is tuple and len(value) == 2:
+		return ''.join(_numberKinds.get(type(x), '?') for x in value)
+	return _numberKinds.get(type(value), '')
+
+def _packValues(values, strings):
+	# Returns (valueType, packed values)
+	kinds = set(_getColumnKind(x) for x in values)
+	if kinds == set(['i']):
+		try:
+			return _ValueType.INT, struct.pack('<%dq' % len(values), *values)
+		except struct.error:
+			pass # Too large
+	elif kinds == set(['f']):
+		return _ValueType.FLOAT, struct.pack('<%dd' % len(values), *values)
+	elif all(isinstance(x, basestring) for x in values):
+		return _ValueType.STRING, struct.pack('<%dI' % len(values), *[strings.add(x) for x in values])
+	elif kinds == set(['ff']):
+		flattened = [y for x in values for y in x]
+		return _ValueType.FLOAT_PAIR, struct.pack('<%dd' % len(flattened), *flattened)
+	elif kinds == set(['ii']):
+		flattened = [y for x in values for y in x]
+		try:
+			return _ValueType.INT_PAIR, struct.pack('<%dq' % len(flattened), *flattened)
+		except struct.error:
+			pass # Too large
+
+	pickled = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+	return _ValueType.PICKLE, struct.pack('<I', len(pickled)) + pickled
+
+def _unpackValues(reader, valueType, count, strings):
+	if valueType == _ValueType.INT:
+		return reader.unpack('<%dq' % count)
+	elif valueType == _ValueType.FLOAT:
+		return reader.unpack('<%dd' % count)
+	elif valueType == _ValueType.STRING:
+		return [strings[x] for x in reader.unpack('<%dI' % count)]
+	elif valueType == _ValueType.FLOAT_PAIR:
+		flattened = reader.unpack('<%dd' % (count * 2))
+		return zip(flattened[0::2], flattened[1::2])
+	elif valueType == _ValueType.INT_PAIR:
+		flattened = reader.unpack('<%dq' % (count * 2))
+		return zip(flattened[0::2], flattened[1::2])
+	elif valueType == _ValueType.PICKLE:
+		return pickle.loads(reader.read(reader.unpack('<I')[0]))
+	raise ValueError('Unknown value type %d' % valueType)
+
+def _decodeString(string):
+	# Non ascii strings are decoded to unicode
+	try:
+		string.decode('ascii')
+	except UnicodeDecodeError:
+		string = string.decode('utf-8')
+	return string
+
+# ------------------------------------------------------
+class _StringTable(object):
+
+	def __init__(self):
+		self.__strings = []
+		self.__stringToIndex = {}
+
+	def add(self, string):
+		index = self.__stringToIndex.get(string)
+		if index is None:
+			index = len(self.__strings)
+			self.__strings.append(string)
+			self.__stringToIndex[string] = index
+		return index
+
+	def pack(self):
+		encoded = [x.encode('utf-8') if isinstance(x, unicode) else x for x in self.__strings]
+		offsets = [0]
+		for string in encoded:
+			offsets.append(offsets[-1] + len(string))
+		return struct.pack('<I%dI' % len(offsets), len(encoded), *offsets) + ''.join(encoded)
+
+	@staticmethod
+	def unpack(reader):
+		# Returns [string]
+		count = reader.unpack('<I')[0]
+		offsets = reader.unpack('<%dI' % (count + 1))
+		data = reader.read(offsets[-1])
+
+		strings = [data[offsets[i]:offsets[i + 1]] for i in xrange(len(offsets) - 1)]
+
+		try:
+			data.decode('ascii')
+		except UnicodeDecodeError:
+			strings = [_decodeString(x) for x in strings]
+		return strings
+
+# ------------------------------------------------------
+class _Reader(object):
+
+	def __init__(self, data):
+		self.__data = data
+		self.__offset = 0
+
+	def tell(self):
+		return self.__offset
+
+	def skip(self, size):
+		self.__offset += size
+
+	def unpack(self, fmt):
+		values = struct.unpack_from(fmt, self.__data, self.__offset)
+		self.__offset += struct.calcsize(fmt)
+		return values
+
+	def unpackArray(self, typeCode):
+		count = self.unpack('<I')[0]
+		return self.unpack('<%d%s' % (count, typeCode))
+
+	def read(self, size):
+		data = self.__data[self.__offset:self.__offset + size]
+		self.__offset += size
+		return data
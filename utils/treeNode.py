@@ -1,3 +1,4 @@
+from collections import namedtuple
 from utils.observable import Observable
 
 # ======================================================
@@ -25,8 +26,15 @@ Predefined events:
 	'childAdded' : data = newChild
 	'attrChanged' : data = (attrName, oldValue, newValue)
 		oldValue==NOT_EXIST if the attribute is created
+	'childrenLoaded' : no additional data, children deferred with _setChildrenLoader() are created
 
 	In addition to these, a subclass can create and notify its own events
+	'attrChanged' events of an attribute can be subscribed to alone, eg.
+
+		node.addObserver(observer, events=[('attrChanged', 'pos'), 'deleted'])
+
+	While notifications are batched (see Observable.beginNotifyBatch()), 'attrChanged' events
+	of the same attribute are merged into one; (attrName, the first oldValue, the last newValue)
 	Nodes being deleted emit 'deleted' events, and
 	'childRemoved' if children exist
 
@@ -37,21 +45,92 @@ A node can observe itself;
 	def _onNotify(self, notifier, event, data):
 		if notifier == self and event in ['childAdded', 'childRemoved']:
 			...
+
+A subtree can be snapshotted and restored later (see getSnapshot() and restoreSnapshot())
+Snapshots share unchanged subtrees with each other so taking them repeatedly is cheap
+
+Creating children can be deferred until they are accessed (see _setChildrenLoader()),
+so that a large tree can be loaded only as much as it's browsed
 """
 
 NOT_EXIST = object()
+
+# node: the TreeNode, attrs: {attrName: value} (read only), children: (TreeNodeSnapshot, ...)
+# children is None if the children were not loaded yet, which means the children as they were loaded
+TreeNodeSnapshot = namedtuple('TreeNodeSnapshot', ['node', 'attrs', 'children'])
+
 class TreeNode(Observable):
 
+	__snapshotBuildCount = 0
+
 	def __init__(self, parent=None):
 		super(TreeNode, self).__init__()
 		self.__attr = {} # {attrName: value}
 		self.__parent = None
 		self.__children = []
+		self.__snapshot = None # Cached TreeNodeSnapshot, None if this subtree has changed since it's taken
+		self.__isDeleted = False
+		self.__childrenLoader = None # Creates the children when they are accessed, None if they exist
+		self.__loadedChildSnapshots = () # Snapshots of the children when they were loaded
 
 		self.setParent(parent)
 
+	@classmethod
+	def _createLoaded(cls, attr, parent=None):
+		"""
+		Creates a node with the attributes as the last child of the parent without emitting any event.
+		For building a whole tree at once (eg. loading a file) where nobody observes the nodes yet.
+		Override this to set up what __init__() sets up other than attributes
+		"""
+		node = cls.__new__(cls)
+		Observable.__init__(node)
+		node.__attr = attr
+		node.__parent = parent
+		node.__children = []
+		node.__snapshot = None
+		node.__isDeleted = False
+		node.__childrenLoader = None
+		node.__loadedChildSnapshots = ()
+		if parent:
+			parent.__children.append(node)
+			parent.__invalidateSnapshot()
+		return node
+
+	def _setChildrenLoader(self, loader):
+		"""
+		Defer creating the children until they are accessed for the first time (eg. loading a large file).
+		loader(node) should create the children with _createLoaded(attr, node).
+		'childrenLoaded' is notified after that
+		"""
+		assert(not self.__children)
+		self.__childrenLoader = loader
+
+	def isChildrenLoaded(self):
+		return self.__childrenLoader is None
+
+	def getLoadedChildSnapshots(self):
+		"""
+		Returns snapshots of the children as they were loaded, what children None of a snapshot means
+		(see getSnapshot() and restoreSnapshot()). () if the children are not deferred or not loaded yet
+		"""
+		return self.__loadedChildSnapshots
+
+	def __loadChildren(self):
+		loader = self.__childrenLoader
+		if loader is None:
+			return
+		self.__childrenLoader = None
+		loader(self)
+		self.__loadedChildSnapshots = tuple([x.getSnapshot() for x in self.__children])
+		self._notify('childrenLoaded')
+
 	def delete(self):
+		"""
+		Observers get 'deleted' and stop observing the node. Attributes are cleared after that
+		"""
 
+		# Children are deleted with the ordinary events so that observers can clean up
+		self.__loadChildren()
 		while self.__children:
 			child = self.__children.pop()
 			child.delete()
@@ -60,10 +139,22 @@ class TreeNode(Observable):
 			self.__parent._removeChild(self)
 			self.__parent = None
 
-		self.__attrs = {}
+		self.__invalidateSnapshot()
+		self.__isDeleted = True
 
 		self._notify('deleted')
-		self.__observers = []
+		self.clearObservers()
+		self.__attr = {}
+
+	def isDeleted(self):
+		return self.__isDeleted
+
+	def _revive(self):
+		"""
+		Called by restoreSnapshot() when a deleted node is put back in the tree.
+		Override this to restore what delete() has cleared
+		"""
+		self.__isDeleted = False
 
 	def setAttr(self, name, value):
 		"""
@@ -71,8 +162,19 @@ class TreeNode(Observable):
 		"""
 		oldValue = self.__attr.get(name, NOT_EXIST)
 		self.__attr[name] = value
+		self.__invalidateSnapshot()
 		self._notify('attrChanged', (name, oldValue, value))
 
+	def _getEventKey(self, event, data):
+		if event == 'attrChanged':
+			return data[0]
+		return None
+
+	def _mergeEventData(self, event, data, newData):
+		if event == 'attrChanged':
+			return data[0], data[1], newData[2]
+		return newData
+
 	def getAttr(self, name):
 		return self.__attr[name]
 
@@ -82,6 +184,9 @@ class TreeNode(Observable):
 	def getAttrDefault(self, name, default=None):
 		return self.__attr.get(name, default)
 
+	def getAttrs(self):
+		return self.__attr.copy()
+
 	def setParent(self, parent):
 		assert(parent != self)
 
@@ -106,21 +211,124 @@ class TreeNode(Observable):
 		pass
 
 	def getChildren(self):
+		self.__loadChildren()
 		return tuple(self.__children)
 
+	def getChildCount(self):
+		self.__loadChildren()
+		return len(self.__children)
+
+	def hasChildren(self):
+		"""
+		Same as bool(getChildren()) but doesn't load the children
+		"""
+		return bool(self.__children) or self.__childrenLoader is not None
+
 	def _removeChild(self, child):
+		self.__loadChildren()
 		if child in self.__children:
 			self.__children.remove(child)
+		self.__invalidateSnapshot()
 		self._notify('childRemoved', child)
 
 	def _addChild(self, child):
+		self.__loadChildren()
 		if not child in self.__children:
 			self.__children.append(child)
+		self.__invalidateSnapshot()
 		self._notify('childAdded', child)
 
+	def getSnapshot(self):
+		"""
+		Returns TreeNodeSnapshot of this subtree.
+		Snapshots of subtrees that haven't changed since the last call are reused,
+		so the cost is proportional to the changed part of the subtree
+		"""
+		if self.__snapshot is None:
+			if self.__childrenLoader:
+				children = None
+			else:
+				children = tuple([x.getSnapshot() for x in self.__children])
+			self.__snapshot = TreeNodeSnapshot(self, self.__attr.copy(), children)
+			TreeNode.__snapshotBuildCount += 1
+		return self.__snapshot
+
+	@staticmethod
+	def getSnapshotBuildCount():
+		"""
+		Returns how many TreeNodeSnapshots have been built so far, useful to estimate memory usage of snapshots
+		"""
+		return TreeNode.__snapshotBuildCount
+
+	def restoreSnapshot(self, snapshot):
+		"""
+		Make this subtree the same as when the snapshot was taken.
+		Only the changed subtrees are visited. Attributes are set, nodes are moved, deleted or
+		revived through the ordinary methods so observers get the same events as usual.
+		Returns the list of the nodes that are put back in the tree after they were deleted or removed.
+		"""
+		assert(snapshot.node == self)
+
+		revivedNodes = []
+		leftovers = [] # [(node, parent)] nodes found under a parent that the snapshot doesn't have them under
+		changedNodes = [] # [(node, snapshot)] in post-order
+		self.__restoreChildren(snapshot, revivedNodes, leftovers, changedNodes)
+
+		# Delete nodes that are not in the snapshot. Nodes moved to another parent are kept
+		for node, parent in leftovers:
+			if node.__parent == parent:
+				node.delete()
+
+		# After all the changes of the hierarchy so that attributes computed from children are overwritten
+		for node, nodeSnapshot in changedNodes:
+			for name, value in nodeSnapshot.attrs.items():
+				if node.__attr.get(name, NOT_EXIST) != value:
+					node.setAttr(name, value)
+			node.__snapshot = nodeSnapshot
+
+		return revivedNodes
+
+	def __restoreChildren(self, snapshot, revivedNodes, leftovers, changedNodes):
+		if self.__snapshot is snapshot:
+			return # Unchanged
+
+		childSnapshots = snapshot.children
+		if childSnapshots is None:
+			# Taken before the children were loaded, so it means the children as loaded
+			childSnapshots = self.__loadedChildSnapshots
+
+		childNodes = set([x.node for x in childSnapshots])
+		for child in self.__children:
+			if child not in childNodes:
+				leftovers.append((child, self))
+
+		for childSnapshot in childSnapshots:
+			child = childSnapshot.node
+			if child.__isDeleted or not child.__parent:
+				child._revive()
+				revivedNodes.append(child)
+			if child.__parent != self:
+				child.setParent(self)
+			child.__restoreChildren(childSnapshot, revivedNodes, leftovers, changedNodes)
+
+		# Children put back are added at the end, the order is restored too. Leftovers are removed later
+		order = [x.node for x in childSnapshots]
+		if self.__children[:len(order)] != order:
+			self.__children = order + [x for x in self.__children if x not in childNodes]
+
+		changedNodes.append((self, snapshot))
+
+	def __invalidateSnapshot(self):
+		# If a node doesn't have a snapshot, its ancestors don't have one either
+		node = self
+		while node and node.__snapshot is not None:
+			node.__snapshot = None
+			node = node.__parent
+
 	def __getstate__(self):
 
-		d = self.__dict__.copy()
+		self.__loadChildren()
+		d = super(TreeNode, self).__getstate__()
 
 		# Remove observers that may not be appropriate to be serialized eg. GUI classes
 		# Also we exclude observers that are not under _serializeRoot to keep parent-child
@@ -130,18 +338,28 @@ class TreeNode(Observable):
 		# expecting it prevents serializing the while TreeNode tree through Python reference but
 		# it doesn't work if we have additional TreeNode observers outside of the tree
 
-		observers = self.getObservers()[:]
-		observers = [x for x in observers if isinstance(x, TreeNode) and x != _serializeRoot]
-		d['_Observable__observers'] = observers
+		subscriptions = d['_Observable__observers']
+		subscriptions = [x for x in subscriptions if isinstance(x[0], TreeNode) and x[0] != _serializeRoot]
+		d['_Observable__observers'] = subscriptions
 
 		# Serialize only the subtree so that it won't pickle every hierarchy from the global root
 		if d['_TreeNode__parent'] == _serializeRoot:
 			d['_TreeNode__parent'] = None
 
+		d['_TreeNode__snapshot'] = None
+		d['_TreeNode__loadedChildSnapshots'] = ()
+
 		return d
 
 	def __setstate__(self, d):
-		self.__dict__ = d
+		super(TreeNode, self).__setstate__(d)
+
+		# Files saved before snapshot support
+		d.setdefault('_TreeNode__snapshot', None)
+		d.setdefault('_TreeNode__isDeleted', False)
+		# Files saved before lazy loading support
+		d.setdefault('_TreeNode__childrenLoader', None)
+		d.setdefault('_TreeNode__loadedChildSnapshots', ())
 
 # ------------------------------------------------------
 _serializeRoot = None
@@ -0,0 +1,105 @@
+import os
+import subprocess
+import Qt
+from Qt import QtWidgets, QtCompat
+
+# ======================================================
+def _compileUi(uiFilePath):
+	"""
+	Compiles the .ui file into python source code with the ui compiler of the Qt binding in use.
+	Returns None if it's not available
+	"""
+	try:
+		if Qt.__binding__ == 'PySide2':
+			try:
+				from pyside2uic import compileUi
+			except ImportError:
+				# PySide2 5.14 or later doesn't have pyside2uic but has uic executable
+				import PySide2
+				uicPath = os.path.join(os.path.dirname(PySide2.__file__), 'uic')
+				return subprocess.check_output([uicPath, '-g', 'python', uiFilePath])
+		elif Qt.__binding__ == 'PyQt5':
+			from PyQt5.uic import compileUi
+		elif Qt.__binding__ == 'PySide':
+			from pysideuic import compileUi
+		elif Qt.__binding__ == 'PyQt4':
+			from PyQt4.uic import compileUi
+		else:
+			return None
+	except (ImportError, OSError, subprocess.CalledProcessError):
+		return None
+
+	from StringIO import StringIO
+	pyFile = StringIO()
+	with open(uiFilePath) as uiFile:
+		compileUi(uiFile, pyFile)
+	return pyFile.getvalue()
+
+# ------------------------------------------------------
+class UiTemplate(object):
+	"""
+	Creates widgets from a Qt Designer .ui file.
+	The file is parsed and compiled into a widget class only once, at the first create() call,
+	so creating many widgets of the same look doesn't parse the XML every time.
+	Falls back to QtCompat.loadUi() per widget if the binding has no ui compiler.
+
+	Child widgets are accessible as attributes of the created widget in both cases;
+		widget = template.create()
+		widget.someButton.clicked.connect(...)
+	"""
+
+	def __init__(self, uiFilePath):
+		self.__uiFilePath = uiFilePath
+		self.__widgetClass = None
+		self.__isCompiled = False
+
+	def create(self):
+		if not self.__isCompiled:
+			self.__widgetClass = self.__compile()
+			self.__isCompiled = True
+
+		if self.__widgetClass:
+			return self.__widgetClass()
+		return QtCompat.loadUi(self.__uiFilePath)
+
+	def __compile(self):
+		pySource = _compileUi(self.__uiFilePath)
+		if not pySource:
+			return None
+
+		namespace = {}
+		exec pySource in namespace
+
+		formClasses = [v for k, v in namespace.items() if k.startswith('Ui_') and isinstance(v, type)]
+		if len(formClasses) != 1:
+			return None
+		formClass = formClasses[0]
+
+		class TemplateWidget(QtWidgets.QWidget, formClass):
+			def __init__(self):
+				super(TemplateWidget, self).__init__()
+				self.setupUi(self)
+
+		return TemplateWidget
+
+# ======================================================
+if __name__ == '__main__':
+	import sys
+	import time
+
+	global app
+	app = QtWidgets.QApplication(sys.argv)
+
+	uiFilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nodeLook.ui')
+	template = UiTemplate(uiFilePath)
+
+	for count in [100, 1000]:
+		start = time.time()
+		for i in range(count):
+			QtCompat.loadUi(uiFilePath)
+		print 'loadUi x %d: %.3f sec' % (count, time.time() - start)
+
+		start = time.time()
+		for i in range(count):
+			template.create()
+		print 'UiTemplate x %d: %.3f sec' % (count, time.time() - start)
@@ -0,0 +1,109 @@
+# ======================================================
+class UndoStack(object):
+	"""
+	Linear undo/redo history of application states.
+
+	States are opaque to this class, typically immutable snapshots sharing unchanged parts with each other.
+	Each state has a cost (eg. the amount of memory it adds on top of the other states) and the oldest
+	states are evicted when the total cost exceeds the budget.
+
+	A pushed state replaces the current one instead of being added if both have the same merge key,
+	so that a series of small edits (eg. typing, dragging) is undone at once.
+	"""
+
+	def __init__(self, costBudget):
+		self.__costBudget = costBudget
+		self.__entries = [] # [[state, cost, mergeKey]]
+		self.__index = -1 # Index of the entry for the current state
+		self.__totalCost = 0
+		self.__isMergeable = False
+
+	def reset(self, state, cost=0):
+		"""
+		Clear the history and make the state the current state
+		"""
+		self.__entries = [[state, cost, None]]
+		self.__index = 0
+		self.__totalCost = cost
+		self.__isMergeable = False
+
+	def push(self, state, cost, mergeKey=None):
+		"""
+		Make the state the current state. Redo history is discarded
+		"""
+		for entry in self.__entries[self.__index + 1:]:
+			self.__totalCost -= entry[1]
+		del self.__entries[self.__index + 1:]
+
+		current = self.__entries[self.__index] if self.__entries else None
+
+		if self.__isMergeable and mergeKey is not None and current[2] == mergeKey:
+			self.replaceCurrent(state, cost)
+			return
+
+		self.__entries.append([state, cost, mergeKey])
+		self.__index += 1
+		self.__totalCost += cost
+		self.__isMergeable = True
+		self.__evict()
+
+	def replaceCurrent(self, state, cost):
+		"""
+		Replace the current state keeping its merge key
+		"""
+		current = self.__entries[self.__index]
+		current[0] = state
+		current[1] += cost
+		self.__totalCost += cost
+		self.__evict()
+
+	def undo(self):
+		"""
+		Returns the previous state and makes it the current state, or None if there is no previous state
+		"""
+		if not self.canUndo():
+			return None
+		self.__index -= 1
+		self.__isMergeable = False
+		return self.__entries[self.__index][0]
+
+	def redo(self):
+		"""
+		Returns the next state and makes it the current state, or None if there is no next state
+		"""
+		if not self.canRedo():
+			return None
+		self.__index += 1
+		self.__isMergeable = False
+		return self.__entries[self.__index][0]
+
+	def canUndo(self):
+		return self.__index > 0
+
+	def canRedo(self):
+		return self.__index < len(self.__entries) - 1
+
+	def __evict(self):
+		# Drop the oldest states but never the current one
+		while self.__totalCost > self.__costBudget and self.__index > 0:
+			entry = self.__entries.pop(0)
+			self.__totalCost -= entry[1]
+			self.__index -= 1
+
+# ======================================================
+if __name__ == '__main__':
+
+	stack = UndoStack(costBudget=10)
+	stack.reset('a', 1)
+	stack.push('b', 1)
+	stack.push('c', 1, mergeKey='typing')
+	stack.push('cc', 1, mergeKey='typing')
+	assert(stack.undo() == 'b')
+	assert(stack.undo() == 'a')
+	assert(stack.undo() == None)
+	assert(stack.redo() == 'b')
+	stack.push('d', 1)
+	assert(not stack.canRedo())
+
+	stack.push('e', 20) # Exceeds the budget, everything but the current state is evicted
+	assert(not stack.canUndo())